@@ -0,0 +1,99 @@
+"""
+JPEG Encoder Benchmark for MagicQC
+==================================
+Measures encode time and output size of each available JPEG backend on
+full-resolution MONO8 frames, at the qualities the camera server uses
+(stream q70 on the 0.25x preview, preview q90 and capture q95 on the
+full frame). Each backend is also run through ParallelJpegEncoder to show
+how strip-parallel encoding scales with the available cores.
+
+Usage:
+    python benchmark_jpeg.py
+    python benchmark_jpeg.py --image capture.jpg --repeat 20
+"""
+
+import argparse
+import statistics
+import time
+
+import cv2
+import numpy as np
+
+from frame_utils import synthetic_frame
+from jpeg_encoder import (
+    OpenCVEncoder, TurboJpegEncoder, ParallelJpegEncoder, TURBOJPEG_AVAILABLE,
+)
+
+SENSOR_WIDTH = 5456
+SENSOR_HEIGHT = 2812
+
+# (label, scale, quality) as used by camera_server.py
+CASES = [
+    ('stream', 0.25, 70),
+    ('preview', 1.0, 90),
+    ('capture', 1.0, 95),
+]
+
+
+def load_frame(path):
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise SystemExit(f"[ERR] Could not read image: {path}")
+    return image
+
+
+def available_encoders():
+    encoders = [OpenCVEncoder()]
+    if TURBOJPEG_AVAILABLE:
+        for fast_dct in (True, False):
+            try:
+                encoder = TurboJpegEncoder(fast_dct=fast_dct)
+            except (RuntimeError, OSError) as e:
+                print(f"[WARN] TurboJPEG unavailable: {e}")
+                break
+            encoder.name = 'turbojpeg' + ('-fastdct' if fast_dct else '')
+            encoders.append(encoder)
+    else:
+        print("[INFO] PyTurboJPEG not installed - benchmarking OpenCV only")
+    return encoders + [ParallelJpegEncoder(e) for e in encoders]
+
+
+def bench(encoder, image, quality, repeat):
+    encoder.encode(image, quality)  # warm up
+    times = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        jpeg = encoder.encode(image, quality)
+        times.append((time.perf_counter() - start) * 1000)
+        size = len(jpeg)
+    return statistics.median(times), min(times), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image', help='MONO8 source image (default: synthetic 5456x2812)')
+    parser.add_argument('--repeat', type=int, default=10, help='encodes per case')
+    args = parser.parse_args()
+
+    frame = load_frame(args.image) if args.image else synthetic_frame(SENSOR_WIDTH, SENSOR_HEIGHT)
+    h, w = frame.shape[:2]
+    print(f"[INFO] Frame: {w}x{h} MONO8, {args.repeat} runs per case\n")
+    print(f"{'encoder':<20}{'case':<10}{'size':>12}{'quality':>9}"
+          f"{'median ms':>12}{'min ms':>10}{'KB':>10}")
+
+    for encoder in available_encoders():
+        for label, scale, quality in CASES:
+            image = frame
+            if scale != 1.0:
+                image = cv2.resize(frame, (int(w * scale), int(h * scale)),
+                                   interpolation=cv2.INTER_NEAREST)
+            median, best, size = bench(encoder, image, quality, args.repeat)
+            ih, iw = image.shape[:2]
+            print(f"{encoder.name:<20}{label:<10}{f'{iw}x{ih}':>12}{quality:>9}"
+                  f"{median:>12.1f}{best:>10.1f}{size / 1024:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Metrics for the MagicQC Camera Server
+=====================================
+A small, dependency-free subset of the Prometheus client: counters,
+gauges and histograms with labels, rendered in the Prometheus text
+exposition format (version 0.0.4) by /api/metrics.
+
+Gauges and counters can also be backed by a function that is called at
+scrape time, for values the server already tracks elsewhere (pool
+exhaustion, SDK frame statistics, connected clients).
+
+    GRABS = counter('magicqc_frames_grabbed_total', 'Frames grabbed')
+    GRABS.inc()
+    ENCODE = histogram('magicqc_encode_seconds', 'JPEG encode time', ['kind'])
+    with ENCODE.time(kind='capture'):
+        ...
+    text = render()
+"""
+
+import math
+import threading
+import time
+
+# Latency buckets in seconds, 0.5 ms .. 10 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=(), fn=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def _samples(self):
+        """[(suffix, label pairs, value)] for the current values."""
+        if self.fn is not None:
+            value = self.fn()
+            if value is None:
+                return []
+            if isinstance(value, dict):
+                # {label value or tuple of label values: number}
+                samples = []
+                for label_values, v in value.items():
+                    if not isinstance(label_values, tuple):
+                        label_values = (label_values,)
+                    samples.append(('', tuple(zip(self.labelnames, map(str, label_values))), v))
+                return samples
+            return [('', (), value)]
+        with self.lock:
+            return [('', key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, value in self._samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block, in seconds."""
+        return _Timer(self, labels)
+
+    def _samples(self):
+        samples = []
+        with self.lock:
+            items = [(key, list(state[0]), state[1], state[2])
+                     for key, state in self.values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                samples.append(('_bucket', key + (('le', _format_value(float(bound))),),
+                                cumulative))
+            samples.append(('_sum', key, total))
+            samples.append(('_count', key, count))
+        return samples
+
+
+REGISTRY = []
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        REGISTRY.append(metric)
+    return metric
+
+
+def counter(name, help_text, labelnames=(), fn=None):
+    return _register(Counter(name, help_text, labelnames, fn))
+
+
+def gauge(name, help_text, labelnames=(), fn=None):
+    return _register(Gauge(name, help_text, labelnames, fn))
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, help_text, labelnames, buckets))
+
+
+def render():
+    """All registered metrics in Prometheus text format."""
+    lines = []
+    with _registry_lock:
+        metrics = list(REGISTRY)
+    for metric in metrics:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            # A failing scrape-time function must not break the endpoint
+            lines.append(f'# {metric.name} unavailable: {_escape(e)}')
+    return '\n'.join(lines) + '\n'
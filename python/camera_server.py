@@ -6,12 +6,22 @@ to the web-based MagicQC dashboard via MJPEG streaming and REST API.
 
 Usage:
     python camera_server.py
+    MAGICQC_SIMULATED_CAMERA=synthetic python camera_server.py   # no hardware
 
 Endpoints:
     GET  /api/status   - Camera status
+    GET  /api/metrics  - Prometheus metrics
     POST /api/mode     - Set garment color mode (black/other)
-    GET  /api/stream   - MJPEG live stream
+    GET  /api/stream   - MJPEG live stream (?scale=&quality=&fps=)
+    WS   /api/ws/stream - Binary JPEG live stream (needs flask-sock, same args)
     POST /api/capture  - Capture single frame (returns base64 JPEG)
+    GET  /api/capture/<seq> - Re-fetch a recent capture from the encode cache
+    GET  /api/capture/stats - Per-phase capture timing percentiles
+    GET  /api/capture-raw - Lossless capture (raw MONO8 buffer, PNG or TIFF)
+    GET  /api/capture-multipart - Full JPEG + thumbnail + JSON metadata
+    POST /api/capture-to-storage - Capture into storage/app/public/annotations
+    POST /api/measurement-roi - Read out only the annotation's placement box
+    POST /api/record   - Record raw frames to a replayable file (DELETE stops)
 
 Runs on http://localhost:5555
 """
@@ -20,8 +30,16 @@ import sys
 import os
 import time
 import threading
+import multiprocessing
 import base64
 import json
+import re
+import tempfile
+import struct
+import uuid
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
 from datetime import datetime
 import socket
 
@@ -34,6 +52,27 @@ sys.path.insert(0, _project_root)
 # Also ensure CWD is project root so SDK DLL resolution works
 os.chdir(_project_root)
 
+# Log file used when there is no console to print to
+LOG_FILE = os.path.join(_project_root, 'storage', 'logs', 'camera_server.log')
+
+
+def redirect_detached_output():
+    """When auto-started by PHP (no console), stdout/stderr may be invalid
+    handles. Detect this and redirect to the log file to prevent crashes."""
+    try:
+        sys.stdout.flush()
+    except (OSError, AttributeError):
+        os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+        log_file = open(LOG_FILE, 'a', buffering=1)
+        sys.stdout = log_file
+        sys.stderr = log_file
+
+
+# The spawned acquisition process re-imports this module and prints while
+# doing so, before acquisition_main runs: guard it here, not in __main__.
+if multiprocessing.current_process().name != 'MainProcess':
+    redirect_detached_output()
+
 # PID file for process management (auto-start from Laravel)
 PID_FILE = os.path.join(_project_root, 'storage', 'app', 'camera_server.pid')
 
@@ -59,6 +98,89 @@ def remove_pid():
         pass
 
 
+# Persisted camera state (last mode, which SDK parameter groups are valid)
+CAMERA_STATE_FILE = os.path.join(_project_root, 'storage', 'app', 'camera_state.json')
+
+
+def load_camera_state():
+    """Read persisted camera state; empty dict if missing or unreadable."""
+    try:
+        with open(CAMERA_STATE_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_camera_state(state):
+    """Write camera state atomically so a crash never leaves half a file."""
+    os.makedirs(os.path.dirname(CAMERA_STATE_FILE), exist_ok=True)
+    tmp_path = f'{CAMERA_STATE_FILE}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp_path, CAMERA_STATE_FILE)
+
+
+# Laravel's public disk — /api/capture-to-storage writes below it
+STORAGE_PUBLIC_PATH = os.path.join(_project_root, 'storage', 'app', 'public')
+
+# Characters that cannot appear in one path component on Windows or Linux
+UNSAFE_PATH_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+def safe_path_component(value, max_length=100):
+    """Make an article style / size safe as one path component, or None."""
+    value = UNSAFE_PATH_CHARS.sub('_', str(value)).strip(' .')
+    return value[:max_length] or None
+
+
+def json_flag(value, default=False):
+    """Read a JSON flag sent as a bool, a number or a string like "false"."""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in ('1', 'true', 'yes', 'on'):
+            return True
+        if value in ('', '0', 'false', 'no', 'off'):
+            return False
+        return default
+    return bool(value)
+
+
+class AtomicFileWriter:
+    """Writes files atomically (temp file, fsync, os.replace) on a worker thread."""
+
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=1,
+                                       thread_name_prefix='storage-writer')
+
+    def submit(self, path, data):
+        """Queue *data* for *path*. Returns a Future for the bytes written."""
+        return self.pool.submit(self._write, path, data)
+
+    @staticmethod
+    def _write(path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return len(data)
+
+
+storage_writer = AtomicFileWriter()
+
+
 # Try to import Flask
 try:
     from flask import Flask, Response, request, jsonify
@@ -71,7 +193,33 @@ except ImportError:
     print("=" * 60)
     sys.exit(1)
 
-from ctypes import c_ubyte
+# Optional WebSocket support for /api/ws/stream
+WEBSOCKET_AVAILABLE = False
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+    WEBSOCKET_AVAILABLE = True
+except ImportError:
+    print("[WARN] flask-sock not installed; /api/ws/stream disabled "
+          "(pip install flask-sock)")
+
+from ctypes import c_ubyte, memmove
+
+from jpeg_encoder import get_encoder, ParallelJpegEncoder
+from frame_utils import SensorMapped, mode_index, synthetic_frame
+from frame_recorder import FrameRecorder, FrameRecording, RECORDING_EXTENSION, \
+    RECORDER_MAX_BYTES
+from camera_metrics import counter, gauge, histogram, render as render_metrics, \
+    CONTENT_TYPE as METRICS_CONTENT_TYPE
+
+# Optional shared-memory frame ring for local consumers (Python 3.8+)
+SHM_AVAILABLE = False
+SHM_NAME = 'magicqc_frames'
+try:
+    from frame_shm import FramePublisher, FrameReader, SHM_NAME
+    SHM_AVAILABLE = True
+except ImportError as e:
+    print(f"[WARN] Shared-memory frame publishing not available: {e}")
 
 # Try to import MindVision SDK
 MINDVISION_AVAILABLE = False
@@ -82,7 +230,15 @@ try:
         CameraAlignFree, CameraSetTriggerMode, CameraPlay,
         CameraUnInit, CameraGetImageBuffer, CameraImageProcess,
         CameraReleaseImageBuffer, CameraFlipFrameBuffer,
-        CameraSetAnalogGain, CameraSetAeState,
+        CameraSetAnalogGain, CameraSetAeState, CameraRstTimeStamp,
+        CameraSaveParameter, CameraLoadParameter, CameraSetImageResolutionEx,
+        CameraSetParameterMask,
+        CameraSetCallbackFunction, CAMERA_SNAP_PROC, method,
+        CameraSoftTrigger, CameraClearBuffer, CameraGetFrameStatistic,
+        CameraGrabber_Create, CameraGrabber_GetCameraHandle,
+        CameraGrabber_SetRGBCallback, CameraGrabber_StartLive,
+        CameraGrabber_StopLive, CameraGrabber_Destroy, CameraGrabber_GetStat,
+        pfnCameraGrabberFrameCallback,
         CAMERA_MEDIA_TYPE_MONO8, CAMERA_STATUS_TIME_OUT,
         CameraException,
     )
@@ -99,14 +255,203 @@ import platform
 # Camera Wrapper Classes
 # ============================================================================
 
+# Preallocated frame buffers per camera: latest frame, SDK fill, readers
+FRAME_POOL_SIZE = 6
+
+
+class FramePool:
+    """Preallocated, reference-counted frame buffers handed out by lease."""
+
+    def __init__(self, count, size, alloc=None, free=None):
+        self.lock = threading.Lock()
+        self.size = size
+        self._free_fn = free
+        self.addresses = []
+        self.arrays = []
+        for _ in range(count):
+            if alloc is not None:
+                address = alloc(size, 16)
+                array = np.frombuffer((c_ubyte * size).from_address(address),
+                                      dtype=np.uint8)
+            else:
+                array = np.empty(size, dtype=np.uint8)
+                address = array.ctypes.data
+            self.addresses.append(address)
+            self.arrays.append(array)
+        self.refs = [0] * count
+        self.free_slots = deque(range(count))
+        self.exhausted = 0   # Grabs skipped because every buffer was leased
+
+    def acquire(self):
+        """Take a free buffer for the next grab. Returns its slot or None."""
+        with self.lock:
+            if not self.free_slots:
+                self.exhausted += 1
+                return None
+            slot = self.free_slots.popleft()
+            self.refs[slot] = 1
+            return slot
+
+    def retain(self, slot):
+        with self.lock:
+            self.refs[slot] += 1
+
+    def release(self, slot):
+        with self.lock:
+            self.refs[slot] -= 1
+            if self.refs[slot] == 0:
+                self.free_slots.append(slot)
+
+    def view(self, slot, height, width):
+        """Zero-copy (height, width) MONO8 view of a buffer."""
+        return self.arrays[slot][:height * width].reshape((height, width))
+
+    def close(self):
+        if self._free_fn is not None:
+            for address in self.addresses:
+                self._free_fn(address)
+        self.addresses = []
+        self.arrays = []
+        self.free_slots.clear()
+
+
+class Frame(SensorMapped):
+    """A grabbed image plus its sensor metadata; pool-backed frames must be released."""
+
+    __slots__ = ('image', 'seq', 'timestamp', 'captured_at', 'exposure_us',
+                 'gain', 'binning', 'offset_x', 'offset_y', '_pool', '_slot')
+
+    def __init__(self, image, timestamp, captured_at=None, exposure_us=0,
+                 gain=0.0, binning=1, pool=None, slot=None, offset=(0, 0)):
+        self.image = image
+        self.seq = 0                  # Assigned by publish_frame()
+        self.timestamp = timestamp    # Sensor timestamp in seconds
+        # Sensor timestamp on the time.monotonic() clock
+        self.captured_at = captured_at if captured_at is not None else time.monotonic()
+        self.exposure_us = exposure_us
+        self.gain = gain
+        self.binning = binning        # Sensor pixels per image pixel (1 = full res)
+        # Full-sensor position of the image's top-left pixel (readout ROI)
+        self.offset_x, self.offset_y = offset
+        self._pool = pool
+        self._slot = slot
+
+    def retain(self):
+        """Take an additional reference for another consumer."""
+        if self._pool is not None:
+            self._pool.retain(self._slot)
+        return self
+
+    def release(self):
+        if self._pool is not None:
+            self._pool.release(self._slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# Sensor settings per garment color mode
+MODE_SETTINGS = {
+    'black': {'gain': 150, 'auto_exposure': False},
+    'white': {'gain': 20, 'auto_exposure': True},
+    'other': {'gain': 64, 'auto_exposure': True},
+}
+
+# SDK parameter group (PARAMETER_TEAM_A/B/C) that holds each mode's settings
+PARAMETER_TEAMS = {'black': 0, 'white': 1, 'other': 2}
+# Only the exposure page (exposure, gain, AE) is saved / loaded per mode.
+# PROP_SHEET_INDEX_EXPOSURE from CameraDefine.h, not exported by mvsdk.
+PROP_SHEET_INDEX_EXPOSURE = 0
+MODE_PARAMETER_MASK = 1 << PROP_SHEET_INDEX_EXPOSURE
+
+camera_state = load_camera_state()
+camera_state_lock = threading.Lock()
+
+
+def update_camera_state(key, value):
+    """Set one persisted state key, re-reading the file so other keys survive."""
+    with camera_state_lock:
+        state = load_camera_state()
+        state[key] = value
+        save_camera_state(state)
+        camera_state.clear()
+        camera_state.update(state)
+
+
+def mode_fingerprint(mode):
+    """Identifies the settings a saved parameter group was built from."""
+    return json.dumps(MODE_SETTINGS[mode], sort_keys=True)
+
+
+# Preview runs binned on the sensor (less data over USB and through the ISP);
+# captures switch to full resolution on demand.
+PREVIEW_BINNING = True
+PREVIEW_BIN_FACTOR = 4
+
+# CameraSetImageResolutionEx modes
+RESOLUTION_MODE_NORMAL = 0
+RESOLUTION_MODE_BIN_AVERAGE = 2
+RESOLUTION_MODE_SKIP = 3
+RESOLUTION_CUSTOM_INDEX = 0xFF
+
+# Readout ROI corners snap outward to multiples of this (sensor pixels)
+ROI_ALIGN = 16
+
+# Seconds between camera clock resets (bounds drift against the host clock)
+CLOCK_RESYNC_INTERVAL = 60.0
+
+
+class SensorClock:
+    """Maps camera frame timestamps onto time.monotonic()."""
+
+    def __init__(self):
+        self.origin = None
+        self.prev_origin = None
+
+    def needs_sync(self):
+        return (self.origin is None or
+                time.monotonic() - self.origin > CLOCK_RESYNC_INTERVAL)
+
+    def sync(self, hCamera):
+        before = time.monotonic()
+        CameraRstTimeStamp(hCamera)
+        after = time.monotonic()
+        self.prev_origin = self.origin
+        self.origin = (before + after) / 2
+
+    def to_host(self, sensor_ts):
+        captured_at = self.origin + sensor_ts
+        if captured_at > time.monotonic() and self.prev_origin is not None:
+            captured_at = self.prev_origin + sensor_ts
+        return captured_at
+
+
+def to_epoch(monotonic_time):
+    """Unix time of a time.monotonic() reading such as Frame.captured_at."""
+    return time.time() - time.monotonic() + monotonic_time
+
+
 class MindVisionCamera:
     """Wrapper for MindVision industrial camera using mvsdk."""
 
     def __init__(self):
         self.hCamera = 0
-        self.pFrameBuffer = 0
+        self.pool = None
         self.cap = None
         self.DevInfo = None
+        self.clock = SensorClock()
+        self.preview_binning = 1
+        self.preview_resolution_mode = RESOLUTION_MODE_NORMAL
+        self.full_resolution = False
+        self.roi = None               # (x, y, w, h) readout window, None = full sensor
+        self.geometries = deque(maxlen=2)   # Recent readout windows, newest last
+        self.trigger_lock = threading.Lock()
+        self.triggered = False
+        self.grab_timeouts = 0
+        self.grab_errors = {}         # CameraException error code -> count
         self.is_open = False
 
     def open(self):
@@ -123,83 +468,439 @@ class MindVisionCamera:
             self.DevInfo = camera_list[0]
             print(f"[INFO] Found camera: {self.DevInfo.GetFriendlyName()}")
 
-            self.hCamera = CameraInit(self.DevInfo, -1, -1)
+            self._init_handle()
             self.cap = CameraGetCapability(self.hCamera)
 
             # Set output to MONO8 for efficient processing
             CameraSetIspOutFormat(self.hCamera, CAMERA_MEDIA_TYPE_MONO8)
+            if CameraSetParameterMask(self.hCamera, MODE_PARAMETER_MASK) != 0:
+                print("[WARN] Could not restrict parameter groups to exposure settings")
 
             buf_size = (self.cap.sResolutionRange.iWidthMax *
                         self.cap.sResolutionRange.iHeightMax * 1)
-            self.pFrameBuffer = CameraAlignMalloc(buf_size, 16)
+            self.pool = FramePool(FRAME_POOL_SIZE, buf_size,
+                                  CameraAlignMalloc, CameraAlignFree)
+
+            if PREVIEW_BINNING:
+                self.preview_binning, self.preview_resolution_mode = \
+                    self._select_preview_binning()
+            self._apply_resolution()
 
             CameraSetTriggerMode(self.hCamera, 0)
-            CameraPlay(self.hCamera)
+            self.clock.sync(self.hCamera)
+            self._start()
 
             self.is_open = True
             print("[INFO] MindVision camera opened (MONO8 mode)")
+            if self.preview_binning > 1:
+                kind = ('bin' if self.preview_resolution_mode == RESOLUTION_MODE_BIN_AVERAGE
+                        else 'skip')
+                print(f"[INFO] Preview uses sensor {kind} "
+                      f"{self.preview_binning}x{self.preview_binning}")
             return True
 
         except CameraException as e:
             print(f"[ERROR] CameraInit failed ({e.error_code}): {e.message}")
+            # Release whatever got set up (handle or grabber, pool) so a
+            # retry or the webcam fallback does not find the camera busy
+            self.close()
             return False
 
+    def _init_handle(self):
+        self.hCamera = CameraInit(self.DevInfo, -1, -1)
+
+    def _start(self):
+        CameraPlay(self.hCamera)
+
     def close(self):
         if self.hCamera > 0:
             CameraUnInit(self.hCamera)
             self.hCamera = 0
-        if self.pFrameBuffer != 0:
-            CameraAlignFree(self.pFrameBuffer)
-            self.pFrameBuffer = 0
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
         self.is_open = False
 
+    def _select_preview_binning(self):
+        """Largest supported (factor, mode) up to PREVIEW_BIN_FACTOR, averaging first."""
+        rng = self.cap.sResolutionRange
+        for factor in range(PREVIEW_BIN_FACTOR, 1, -1):
+            bit = 1 << (factor - 2)
+            if rng.uBinAverageModeMask & bit:
+                return factor, RESOLUTION_MODE_BIN_AVERAGE
+            if rng.uSkipModeMask & bit:
+                return factor, RESOLUTION_MODE_SKIP
+        return 1, RESOLUTION_MODE_NORMAL
+
+    @property
+    def sensor_size(self):
+        rng = self.cap.sResolutionRange
+        return rng.iWidthMax, rng.iHeightMax
+
+    def _apply_resolution(self):
+        """Program the sensor for preview (binned) or capture (full) output,
+        reading out only the ROI if one is set. Returns False if refused."""
+        if self.full_resolution or self.preview_binning == 1:
+            mode, mode_size = RESOLUTION_MODE_NORMAL, 0
+        else:
+            mode, mode_size = self.preview_resolution_mode, self.preview_binning - 1
+        fov = self.roi or (0, 0) + self.sensor_size
+        err = CameraSetImageResolutionEx(self.hCamera, RESOLUTION_CUSTOM_INDEX,
+                                         mode, mode_size, *fov, 0, 0)
+        if err != 0:
+            print(f"[WARN] Camera rejected resolution {fov} (mode {mode}, error {err})")
+            return False
+        if not self.geometries or self.geometries[-1] != fov:
+            self.geometries.append(fov)
+        return True
+
+    def set_roi(self, roi):
+        """Read out only *roi* = (x, y, w, h), None = full sensor; None if refused."""
+        if not self.is_open:
+            return None
+        if roi is not None:
+            sensor_w, sensor_h = self.sensor_size
+            x, y, w, h = roi
+            x1 = max(0, int(x) // ROI_ALIGN * ROI_ALIGN)
+            y1 = max(0, int(y) // ROI_ALIGN * ROI_ALIGN)
+            x2 = min(sensor_w, -(-int(x + w) // ROI_ALIGN) * ROI_ALIGN)
+            y2 = min(sensor_h, -(-int(y + h) // ROI_ALIGN) * ROI_ALIGN)
+            roi = (x1, y1, x2 - x1, y2 - y1)
+            if roi == (0, 0, sensor_w, sensor_h):
+                roi = None
+        previous, self.roi = self.roi, roi
+        if not self._apply_resolution():
+            self.roi = previous
+            self._apply_resolution()
+            return None
+        return roi or (0, 0) + self.sensor_size
+
+    def _frame_geometry(self, width, height):
+        """(offset_x, offset_y, binning) of a delivered frame, from recent windows."""
+        for x, y, w, h in reversed(self.geometries):
+            binning = max(1, round(w / width))
+            if abs(w / binning - width) <= 1 and abs(h / binning - height) <= 1:
+                return x, y, binning
+        return 0, 0, max(1, round(self.sensor_size[0] / width))
+
+    def set_capture_resolution(self, full):
+        """Switch between binned preview and full resolution; True if changed."""
+        if not self.is_open or self.preview_binning == 1 or full == self.full_resolution:
+            return False
+        self.full_resolution = full
+        if not self._apply_resolution():
+            self.full_resolution = not full
+            self._apply_resolution()
+            return False
+        return True
+
+    def begin_triggered_capture(self):
+        """Drop in-flight frames and software-trigger one exposure; its time or None."""
+        if not self.is_open:
+            return None
+        with self.trigger_lock:
+            CameraSetTriggerMode(self.hCamera, 1)
+            self.triggered = True
+            CameraClearBuffer(self.hCamera)
+            self._discard_pending()
+            triggered_at = time.monotonic()
+            if CameraSoftTrigger(self.hCamera) != 0:
+                print("[WARN] Software trigger failed; capturing free-running")
+                CameraSetTriggerMode(self.hCamera, 0)
+                self.triggered = False
+                return None
+            return triggered_at
+
+    def _discard_pending(self):
+        """Drop frames processed but not yet handed to grab(); none here."""
+
+    def end_triggered_capture(self):
+        """Return to continuous (free-running) acquisition for the preview."""
+        with self.trigger_lock:
+            if self.triggered and self.is_open:
+                CameraSetTriggerMode(self.hCamera, 0)
+            self.triggered = False
+
     def set_mode(self, mode):
         """Set gain and auto-exposure based on garment color."""
         if not self.is_open:
             return
-        if mode == 'black':
-            CameraSetAnalogGain(self.hCamera, 150)
-            CameraSetAeState(self.hCamera, 0)  # AE OFF
-            print("[INFO] Mode: BLACK (gain=150, AE=OFF)")
-        elif mode == 'white':
-            CameraSetAnalogGain(self.hCamera, 20)
-            CameraSetAeState(self.hCamera, 1)  # AE ON
-            print("[INFO] Mode: WHITE (gain=20, AE=ON)")
-        else:
-            CameraSetAnalogGain(self.hCamera, 64)
-            CameraSetAeState(self.hCamera, 1)  # AE ON
-            print("[INFO] Mode: OTHER (gain=64, AE=ON)")
+        if mode not in MODE_SETTINGS:
+            mode = 'other'
+        settings = MODE_SETTINGS[mode]
+        team = PARAMETER_TEAMS[mode]
+        ae_label = 'ON' if settings['auto_exposure'] else 'OFF'
+
+        with camera_state_lock:
+            groups = camera_state.get('parameter_groups', {})
+            warm = groups.get(mode) == mode_fingerprint(mode)
+
+        if warm and self._load_mode_group(team):
+            print(f"[INFO] Mode: {mode.upper()} (gain={settings['gain']}, "
+                  f"AE={ae_label}, parameter group {team})")
+            return
+
+        CameraSetAnalogGain(self.hCamera, settings['gain'])
+        CameraSetAeState(self.hCamera, 1 if settings['auto_exposure'] else 0)
+        print(f"[INFO] Mode: {mode.upper()} (gain={settings['gain']}, AE={ae_label})")
+        self.save_mode_state(mode)
+
+    def _load_mode_group(self, team):
+        """Load parameter group *team*; returns False if the SDK refused."""
+        with self.trigger_lock:
+            if CameraLoadParameter(self.hCamera, team) != 0:
+                return False
+            # Older groups were saved with every page; whatever they held,
+            # keep the current resolution and trigger mode
+            self._apply_resolution()
+            CameraSetTriggerMode(self.hCamera, 1 if self.triggered else 0)
+        return True
+
+    def save_mode_state(self, mode):
+        """Store the current exposure settings as *mode*'s group."""
+        if not self.is_open or mode not in PARAMETER_TEAMS:
+            return
+        # A triggered capture switches trigger mode under this lock
+        with self.trigger_lock:
+            saved = CameraSaveParameter(self.hCamera, PARAMETER_TEAMS[mode]) == 0
+        if not saved:
+            print(f"[WARN] Could not save parameter group for mode '{mode}'")
+            return
+        groups = dict(load_camera_state().get('parameter_groups', {}))
+        groups[mode] = mode_fingerprint(mode)
+        update_camera_state('parameter_groups', groups)
 
     def grab(self):
-        """Grab a single frame. Returns BGR numpy array or None."""
+        """Grab a single frame. Returns a MONO8 Frame or None."""
         if not self.is_open:
             return None
+        # Every buffer still leased by a consumer: skip this grab rather
+        # than overwrite a frame someone is reading.
+        slot = self.pool.acquire()
+        if slot is None:
+            return None
         try:
+            if self.clock.needs_sync():
+                self.clock.sync(self.hCamera)
             pRawData, FrameHead = CameraGetImageBuffer(self.hCamera, 200)
-            CameraImageProcess(self.hCamera, pRawData,
-                               self.pFrameBuffer, FrameHead)
-            CameraReleaseImageBuffer(self.hCamera, pRawData)
-
-            if platform.system() == "Windows":
-                CameraFlipFrameBuffer(self.pFrameBuffer, FrameHead, 1)
-
-            frame_data = (c_ubyte * FrameHead.uBytes).from_address(
-                self.pFrameBuffer)
-            frame = np.frombuffer(frame_data, dtype=np.uint8)
-            # Return grayscale directly — cv2.imencode handles it fine
-            # and avoids expensive GRAY2BGR on 5456x2812 frames
-            return frame.reshape((FrameHead.iHeight, FrameHead.iWidth))
+            try:
+                return self._process_frame(slot, pRawData, FrameHead)
+            finally:
+                CameraReleaseImageBuffer(self.hCamera, pRawData)
 
         except CameraException as e:
-            if e.error_code != CAMERA_STATUS_TIME_OUT:
+            self.pool.release(slot)
+            if e.error_code == CAMERA_STATUS_TIME_OUT:
+                self.grab_timeouts += 1
+            else:
+                self._count_error(e)
                 print(f"[ERROR] Grab failed ({e.error_code}): {e.message}")
             return None
 
+    def _count_error(self, e):
+        self.grab_errors[e.error_code] = self.grab_errors.get(e.error_code, 0) + 1
+
+    def _process_frame(self, slot, pRawData, FrameHead):
+        """Run the ISP on a raw SDK buffer into pool *slot*; returns the Frame."""
+        CameraImageProcess(self.hCamera, pRawData,
+                           self.pool.addresses[slot], FrameHead)
+        return self._make_frame(slot, FrameHead)
+
+    def _make_frame(self, slot, FrameHead):
+        """Wrap processed MONO8 data in pool *slot* as a Frame."""
+        pFrameBuffer = self.pool.addresses[slot]
+        if platform.system() == "Windows":
+            CameraFlipFrameBuffer(pFrameBuffer, FrameHead, 1)
+
+        # Return grayscale directly — cv2.imencode handles it fine
+        # and avoids expensive GRAY2BGR on 5456x2812 frames
+        image = self.pool.view(slot, FrameHead.iHeight, FrameHead.iWidth)
+        # uiTimeStamp is in 0.1 ms units of the camera clock
+        sensor_ts = FrameHead.uiTimeStamp / 10000.0
+        offset_x, offset_y, binning = self._frame_geometry(FrameHead.iWidth,
+                                                           FrameHead.iHeight)
+        return Frame(image, sensor_ts, self.clock.to_host(sensor_ts),
+                     FrameHead.uiExpTime, FrameHead.fAnalogGain,
+                     binning, pool=self.pool, slot=slot,
+                     offset=(offset_x, offset_y))
+
+    def acquisition_stats(self):
+        """Counters for /api/status, to compare acquisition backends."""
+        stats = {
+            'backend': CAMERA_BACKEND_NAMES.get(type(self), 'polling'),
+            'pool_exhausted': self.pool.exhausted if self.pool else 0,
+            'grab_timeouts': self.grab_timeouts,
+            'grab_errors': {str(code): n for code, n in self.grab_errors.items()},
+        }
+        if self.is_open:
+            stat = CameraGetFrameStatistic(self.hCamera)
+            stats.update({
+                'sdk_frames_total': stat.iTotal,
+                'sdk_frames_captured': stat.iCapture,
+                'sdk_frames_lost': stat.iLost,
+            })
+        return stats
+
     @property
     def camera_type(self):
         return "mindvision"
 
 
+# Processed frames the SDK callback may queue ahead of the stream worker;
+# beyond this the oldest is dropped so consumers always get the newest.
+CALLBACK_QUEUE_DEPTH = 2
+
+
+class MindVisionCallbackCamera(MindVisionCamera):
+    """MindVision camera driven by the SDK's frame callback."""
+
+    def __init__(self):
+        super().__init__()
+        self.cond = threading.Condition()
+        self.ready = deque()
+        self.callback_active = False
+        self.dropped = 0   # Frames lost to a full queue or no free buffer
+        self.generation = 0   # Bumped by _discard_pending()
+
+    def _start(self):
+        # self.on_frame is mvsdk's cached CAMERA_SNAP_PROC thunk; it lives
+        # as long as this instance
+        if CameraSetCallbackFunction(self.hCamera, self.on_frame, 0) == 0:
+            self.callback_active = True
+            print("[INFO] MindVision acquisition via SDK frame callback")
+        else:
+            print("[WARN] Could not register frame callback; polling instead")
+        super()._start()
+
+    def close(self):
+        if self.callback_active:
+            self.callback_active = False
+            CameraSetCallbackFunction(self.hCamera, None, 0)
+        self._discard_pending()
+        with self.cond:
+            self.cond.notify_all()
+        super().close()
+
+    def _discard_pending(self):
+        """Drop queued frames, and any frame the SDK thread is still processing."""
+        with self.cond:
+            self.generation += 1
+            while self.ready:
+                self.ready.popleft().release()
+
+    def _on_frame(self, hCamera, pRawData, pFrameHead, pContext):
+        """CAMERA_SNAP_PROC body; runs on the SDK thread. The SDK releases pRawData."""
+        if not self.callback_active:
+            return
+        generation = self.generation
+        slot = self.pool.acquire()
+        if slot is None:
+            self.dropped += 1
+            return
+        try:
+            frame = self._process_frame(slot, pRawData, pFrameHead[0])
+        except CameraException as e:
+            self.pool.release(slot)
+            self._count_error(e)
+            print(f"[ERROR] Frame callback failed ({e.error_code}): {e.message}")
+            return
+        self._queue_frame(frame, generation)
+
+    def _queue_frame(self, frame, generation):
+        with self.cond:
+            if generation != self.generation:
+                # Exposed before a trigger cleared the pipeline
+                frame.release()
+                return
+            if len(self.ready) >= CALLBACK_QUEUE_DEPTH:
+                self.ready.popleft().release()
+                self.dropped += 1
+            self.ready.append(frame)
+            self.cond.notify()
+
+    def acquisition_stats(self):
+        stats = super().acquisition_stats()
+        stats['callback_active'] = self.callback_active
+        stats['dropped'] = self.dropped
+        return stats
+
+    def grab(self):
+        """Next frame delivered by the callback. Returns a MONO8 Frame or None."""
+        if not self.callback_active:
+            return super().grab()
+        if self.clock.needs_sync():
+            self.clock.sync(self.hCamera)
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.ready or not self.is_open, 0.2):
+                return None
+            return self.ready.popleft() if self.ready else None
+
+
+class MindVisionGrabberCamera(MindVisionCallbackCamera):
+    """MindVision camera driven by the SDK's CameraGrabber."""
+
+    def __init__(self):
+        super().__init__()
+        self.grabber = None
+
+    def _init_handle(self):
+        self.grabber = CameraGrabber_Create(self.DevInfo)
+        self.hCamera = CameraGrabber_GetCameraHandle(self.grabber)
+
+    def _start(self):
+        err = CameraGrabber_SetRGBCallback(self.grabber, self.on_grabber_frame, 0)
+        if err != 0:
+            raise CameraException(err)
+        self.callback_active = True
+        CameraGrabber_StartLive(self.grabber)
+        print("[INFO] MindVision acquisition via CameraGrabber")
+
+    def close(self):
+        if self.grabber is not None:
+            self.callback_active = False
+            CameraGrabber_StopLive(self.grabber)
+            # Destroying the grabber also uninitializes the camera
+            CameraGrabber_Destroy(self.grabber)
+            self.grabber = None
+            self.hCamera = 0
+        super().close()
+
+    def _on_grabber_frame(self, grabber, pFrameBuffer, pFrameHead, pContext):
+        """pfnCameraGrabberFrameCallback body; runs on the grabber thread."""
+        if not self.callback_active:
+            return
+        generation = self.generation
+        slot = self.pool.acquire()
+        if slot is None:
+            self.dropped += 1
+            return
+        head = pFrameHead[0]
+        memmove(self.pool.addresses[slot], pFrameBuffer, head.iWidth * head.iHeight)
+        self._queue_frame(self._make_frame(slot, head), generation)
+
+    def acquisition_stats(self):
+        stats = super().acquisition_stats()
+        if self.grabber is not None:
+            stat = CameraGrabber_GetStat(self.grabber)
+            stats.update({
+                'grabber_captured': stat.Capture,
+                'grabber_lost': stat.Lost,
+                'grabber_errors': stat.Error,
+                'grabber_capture_fps': round(stat.CapFps, 2),
+                'grabber_display_fps': round(stat.DispFps, 2),
+            })
+        return stats
+
+
+if MINDVISION_AVAILABLE:
+    # mvsdk's `method` descriptor wraps each callback in a per-instance
+    # ctypes thunk; attached here since mvsdk may be missing.
+    MindVisionCallbackCamera.on_frame = method(CAMERA_SNAP_PROC)(
+        MindVisionCallbackCamera._on_frame)
+    MindVisionGrabberCamera.on_grabber_frame = method(pfnCameraGrabberFrameCallback)(
+        MindVisionGrabberCamera._on_grabber_frame)
+
+
 class WebcamCamera:
     """Fallback wrapper using OpenCV VideoCapture (standard webcam)."""
 
@@ -247,84 +948,1170 @@ class WebcamCamera:
             self.cap.set(cv2.CAP_PROP_GAIN, 64)
         print(f"[INFO] Webcam mode: {mode.upper()}")
 
+    def save_mode_state(self, mode):
+        """Webcam has no parameter groups to persist."""
+
+    def set_capture_resolution(self, full):
+        """Webcam always streams at capture resolution."""
+        return False
+
     def grab(self):
-        """Grab a single frame. Returns BGR numpy array or None."""
+        """Grab a single frame. Returns a BGR Frame or None."""
         if not self.is_open or not self.cap:
             return None
-        ret, frame = self.cap.read()
-        return frame if ret else None
+        ret, image = self.cap.read()
+        if not ret:
+            return None
+        now = time.monotonic()
+        return Frame(image, now, now)
+
+    def begin_triggered_capture(self):
+        """Webcams have no trigger; captures use the free-running stream."""
+        return None
+
+    def set_roi(self, roi):
+        """Webcams have no readout ROI."""
+        return None
+
+    def end_triggered_capture(self):
+        pass
+
+    def acquisition_stats(self):
+        return {'backend': 'webcam'}
 
     @property
     def camera_type(self):
         return "webcam"
 
 
+# Simulated camera (env MAGICQC_SIMULATED_CAMERA): None = real camera,
+# 'synthetic', an image directory or a .mqrec recording
+SIMULATED_CAMERA = os.environ.get('MAGICQC_SIMULATED_CAMERA') or None
+SIMULATED_DEFAULT_FPS = 30.0
+
+
+def simulated_fps_from_env():
+    """MAGICQC_SIMULATED_FPS if it is a positive number, else the default."""
+    value = os.environ.get('MAGICQC_SIMULATED_FPS')
+    if not value:
+        return SIMULATED_DEFAULT_FPS
+    try:
+        fps = float(value)
+    except ValueError:
+        fps = 0.0
+    if not 0 < fps < float('inf'):
+        print(f"[WARN] Invalid MAGICQC_SIMULATED_FPS '{value}'; "
+              f"using {SIMULATED_DEFAULT_FPS:g} fps")
+        return SIMULATED_DEFAULT_FPS
+    return fps
+
+
+SIMULATED_FPS = simulated_fps_from_env()
+SIMULATED_SENSOR_SIZE = (5456, 2812)   # Same sensor as the MindVision camera
+SIMULATED_EXPOSURE_US = 20000
+# Scene brightness per mode (black garments are shot brighter, white darker)
+SIMULATED_MODE_BRIGHTNESS = {'black': 1.6, 'white': 0.6, 'other': 1.0}
+# Frames the brightness takes to reach a new mode's level, like auto exposure
+SIMULATED_SETTLE_FRAMES = 5
+# Pre-rendered synthetic frames cycled through (differ only in noise)
+SIMULATED_VARIANTS = 4
+SIMULATED_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+class SimulatedCamera:
+    """Hardware-free camera: synthetic frames, an image directory or a recording."""
+
+    def __init__(self, source='synthetic', fps=SIMULATED_FPS):
+        self.source = source
+        self.fps = fps
+        self.images = []
+        self.recording = None
+        self.index = 0
+        self.pool = None
+        self.next_due = 0.0
+        self.brightness = SIMULATED_MODE_BRIGHTNESS['other']
+        self.brightness_step = 0.0
+        self.ramp_frames = 0          # Frames left until the mode's brightness
+        self.gain = MODE_SETTINGS['other']['gain']
+        self.is_open = False
+
+    def _load_directory(self, path):
+        names = sorted(n for n in os.listdir(path)
+                       if n.lower().endswith(SIMULATED_IMAGE_EXTENSIONS))
+        size = None
+        for name in names:
+            image = cv2.imread(os.path.join(path, name), cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                print(f"[WARN] Simulated camera: cannot read {name}")
+                continue
+            if size is None:
+                size = image.shape[1], image.shape[0]
+            elif (image.shape[1], image.shape[0]) != size:
+                image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            self.images.append(image)
+
+    def open(self):
+        if self.is_open:
+            return True
+        if self.source == 'synthetic':
+            w, h = SIMULATED_SENSOR_SIZE
+            self.images = [synthetic_frame(w, h, seed)
+                           for seed in range(SIMULATED_VARIANTS)]
+        elif os.path.isdir(self.source):
+            self._load_directory(self.source)
+        elif os.path.isfile(self.source):
+            try:
+                self.recording = FrameRecording(self.source)
+            except (OSError, ValueError) as e:
+                print(f"[ERROR] Simulated camera: {e}")
+                return False
+            if not len(self.recording):
+                self.recording.close()
+                self.recording = None
+        else:
+            print(f"[ERROR] Simulated camera source not found: {self.source}")
+            return False
+        if self.recording is not None:
+            entry = self.recording.index[0]
+            w, h = int(entry['width']), int(entry['height'])
+            count, size = len(self.recording), self.recording.max_frame_bytes
+        elif self.images:
+            h, w = self.images[0].shape
+            count, size = len(self.images), w * h
+        else:
+            print(f"[ERROR] Simulated camera: no frames in {self.source}")
+            return False
+        self.pool = FramePool(FRAME_POOL_SIZE, size)
+        self.next_due = time.monotonic()
+        self.is_open = True
+        rate = 'recorded timing' if self.recording is not None else f'{self.fps:g} fps'
+        print(f"[INFO] Simulated camera opened: {w}x{h} MONO8 at {rate} "
+              f"({self.source}, {count} frames)")
+        return True
+
+    def close(self):
+        self.is_open = False
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        if self.recording is not None:
+            self.recording.close()
+            self.recording = None
+        self.images = []
+
+    def set_mode(self, mode):
+        target = SIMULATED_MODE_BRIGHTNESS.get(mode, 1.0)
+        self.brightness_step = (target - self.brightness) / SIMULATED_SETTLE_FRAMES
+        self.ramp_frames = SIMULATED_SETTLE_FRAMES
+        self.gain = MODE_SETTINGS.get(mode, MODE_SETTINGS['other'])['gain']
+        print(f"[INFO] Simulated camera mode: {mode.upper()}")
+
+    def save_mode_state(self, mode):
+        """Nothing to persist."""
+
+    def set_capture_resolution(self, full):
+        """Always full resolution."""
+        return False
+
+    def _next_brightness(self):
+        if self.ramp_frames:
+            self.ramp_frames -= 1
+            self.brightness += self.brightness_step
+        return self.brightness
+
+    def grab(self):
+        """Next frame, paced to the configured fps. Returns a MONO8 Frame or None."""
+        if not self.is_open:
+            return None
+        delay = self.next_due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        now = time.monotonic()
+        # Fall behind by at most one frame, like a sensor dropping frames
+        self.next_due = max(self.next_due + self._interval(), now)
+        slot = self.pool.acquire()
+        if slot is None:
+            return None
+        if self.recording is not None:
+            return self._replay(slot, now)
+        source = self.images[self.index % len(self.images)]
+        self.index += 1
+        h, w = source.shape
+        image = self.pool.view(slot, h, w)
+        cv2.convertScaleAbs(source, image, self._next_brightness())
+        return Frame(image, now, now, SIMULATED_EXPOSURE_US, float(self.gain),
+                     pool=self.pool, slot=slot)
+
+    def _interval(self):
+        """Seconds until the frame after the current one is due."""
+        if self.recording is None:
+            return 1.0 / self.fps
+        captured_at = self.recording.index['captured_at']
+        i = self.index % len(self.recording)
+        if i + 1 >= len(self.recording):
+            return 1.0 / self.fps    # Looping back to the start
+        return min(max(captured_at[i + 1] - captured_at[i], 0.0), 1.0)
+
+    def _replay(self, slot, now):
+        recorded = self.recording[self.index % len(self.recording)]
+        self.index += 1
+        h, w = recorded.image.shape
+        image = self.pool.view(slot, h, w)
+        np.copyto(image, recorded.image)
+        return Frame(image, recorded.timestamp, now, recorded.exposure_us,
+                     recorded.gain, recorded.binning, pool=self.pool, slot=slot,
+                     offset=(recorded.offset_x, recorded.offset_y))
+
+    def begin_triggered_capture(self):
+        """No trigger; captures use the free-running frames."""
+        return None
+
+    def end_triggered_capture(self):
+        pass
+
+    def set_roi(self, roi):
+        """No readout ROI."""
+        return None
+
+    def acquisition_stats(self):
+        return {
+            'backend': 'simulated',
+            'source': self.source,
+            'fps': self.fps,
+            'pool_exhausted': self.pool.exhausted if self.pool else 0,
+        }
+
+    @property
+    def camera_type(self):
+        return "simulated"
+
+
+# ============================================================================
+# Acquisition Process
+# ============================================================================
+
+# A separate process owns the SDK handle and grabs into the frame_shm ring
+# that local FrameReaders use, so server load cannot jitter the grab loop
+ACQUISITION_PROCESS = False
+ACQUISITION_SHM_NAME = SHM_NAME
+ACQUISITION_START_TIMEOUT = 15.0     # Seconds to wait for the camera to open
+ACQUISITION_COMMANDS = ('set_mode', 'save_mode_state', 'set_capture_resolution',
+                        'acquisition_stats', 'begin_triggered_capture',
+                        'end_triggered_capture', 'set_roi')
+
+# How MindVision frames are acquired: 'callback', 'grabber' or 'polling'
+CAMERA_BACKEND = 'callback'
+MINDVISION_BACKENDS = {
+    'polling': MindVisionCamera,
+    'callback': MindVisionCallbackCamera,
+    'grabber': MindVisionGrabberCamera,
+}
+CAMERA_BACKEND_NAMES = {cls: name for name, cls in MINDVISION_BACKENDS.items()}
+
+
+def open_local_camera():
+    """Open the simulated camera if configured, else the MindVision camera,
+    else the webcam. Returns it or None."""
+    if SIMULATED_CAMERA:
+        cam = SimulatedCamera(SIMULATED_CAMERA)
+        return cam if cam.open() else None
+
+    if MINDVISION_AVAILABLE:
+        backend = MINDVISION_BACKENDS.get(CAMERA_BACKEND)
+        if backend is None:
+            print(f"[WARN] Unknown CAMERA_BACKEND '{CAMERA_BACKEND}'; polling")
+            backend = MindVisionCamera
+        cam = backend()
+        if cam.open():
+            return cam
+        print("[WARN] MindVision camera failed, trying webcam fallback...")
+
+    cam = WebcamCamera(0)
+    if cam.open():
+        return cam
+    return None
+
+
+def acquisition_main(conn, shm_name):
+    """Acquisition process: grab into the *shm_name* ring, serve commands on *conn*."""
+    cam = open_local_camera()
+    if cam is None:
+        conn.send(('error', 'No camera available'))
+        return
+
+    # Size the ring for the largest frame; the webcam has no pool, so
+    # take a first frame to learn its size.
+    first = None
+    slot_size = cam.pool.size if getattr(cam, 'pool', None) else 0
+    while not slot_size:
+        first = cam.grab()
+        if first is not None:
+            slot_size = first.image.nbytes
+    publisher = FramePublisher(slot_size, name=shm_name)
+    conn.send(('ready', {'camera_type': cam.camera_type, 'slot_size': slot_size,
+                         'sensor_size': getattr(cam, 'sensor_size', None)}))
+
+    stop = threading.Event()
+    mode = [current_mode]
+
+    def serve_commands():
+        while True:
+            try:
+                cmd, args = conn.recv()
+            except (EOFError, OSError):
+                break
+            if cmd == 'close':
+                break
+            try:
+                if cmd not in ACQUISITION_COMMANDS or not hasattr(cam, cmd):
+                    raise ValueError(f'unknown command {cmd!r}')
+                result = getattr(cam, cmd)(*args)
+                if cmd == 'set_mode':
+                    mode[0] = args[0]
+                conn.send(('ok', result))
+            except Exception as e:
+                conn.send(('error', str(e)))
+        stop.set()
+
+    threading.Thread(target=serve_commands, daemon=True).start()
+
+    seq = 0
+    frame = first
+    try:
+        while not stop.is_set():
+            if frame is None:
+                frame = cam.grab()
+                if frame is None:
+                    time.sleep(0.005)
+                    continue
+            with frame:
+                seq += 1
+                publisher.publish(frame.image, seq, frame.timestamp,
+                                  frame.captured_at, frame.exposure_us,
+                                  frame.gain, frame.binning, mode[0],
+                                  (frame.offset_x, frame.offset_y))
+            frame = None
+    finally:
+        cam.close()
+        publisher.close()
+
+
+class ProcessCamera:
+    """Camera proxy whose SDK handle lives in the acquisition process."""
+
+    def __init__(self):
+        self.process = None
+        self.conn = None
+        self.reader = None
+        self.pool = None
+        self.cmd_lock = threading.Lock()
+        self.last_seq = 0
+        self._camera_type = None
+        self.sensor_size = None
+        self.roi = None
+        self.is_open = False
+
+    def open(self):
+        # spawn, not fork: the child must not inherit the server's threads
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=acquisition_main,
+                                   args=(child_conn, ACQUISITION_SHM_NAME),
+                                   name='camera-acquisition', daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        if not self.conn.poll(ACQUISITION_START_TIMEOUT):
+            print("[ERROR] Acquisition process did not start in time")
+            self.close()
+            return False
+        try:
+            status, info = self.conn.recv()
+        except EOFError:
+            status, info = 'error', 'process exited'
+        if status != 'ready':
+            print(f"[ERROR] Acquisition process failed: {info}")
+            self.close()
+            return False
+
+        self._camera_type = info['camera_type']
+        self.sensor_size = info['sensor_size']
+        self.pool = FramePool(FRAME_POOL_SIZE, info['slot_size'])
+        self.reader = FrameReader(ACQUISITION_SHM_NAME, untrack=False)
+        self.is_open = True
+        print(f"[INFO] Acquisition process started (pid {self.process.pid}, "
+              f"{self._camera_type})")
+        return True
+
+    def close(self):
+        self.is_open = False
+        if self.conn is not None:
+            try:
+                with self.cmd_lock:
+                    self.conn.send(('close', ()))
+            except (OSError, ValueError):
+                pass
+        if self.process is not None:
+            self.process.join(timeout=3)
+            if self.process.is_alive():
+                self.process.terminate()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self.pool is not None:
+            self.pool.close()
+
+    def _call(self, cmd, *args):
+        if not self.is_open:
+            return None
+        with self.cmd_lock:
+            try:
+                self.conn.send((cmd, args))
+                status, result = self.conn.recv()
+            except (EOFError, OSError) as e:
+                print(f"[ERROR] Acquisition process unreachable: {e}")
+                self.is_open = False
+                return None
+        if status != 'ok':
+            print(f"[ERROR] Acquisition {cmd} failed: {result}")
+            return None
+        return result
+
+    def set_mode(self, mode):
+        self._call('set_mode', mode)
+
+    def save_mode_state(self, mode):
+        self._call('save_mode_state', mode)
+
+    def set_capture_resolution(self, full):
+        return bool(self._call('set_capture_resolution', full))
+
+    def acquisition_stats(self):
+        stats = self._call('acquisition_stats') or {}
+        return {**stats, 'process': True}
+
+    def set_roi(self, roi):
+        applied = self._call('set_roi', roi)
+        if applied is not None:
+            full = (0, 0) + tuple(self.sensor_size)
+            self.roi = tuple(applied) if tuple(applied) != full else None
+        return applied
+
+    def begin_triggered_capture(self):
+        # time.monotonic() is system-wide, so the child's trigger time
+        # compares directly with frame capture times here
+        triggered_at = self._call('begin_triggered_capture')
+        if triggered_at is not None:
+            # Skip frames the child put in the ring before the trigger
+            self.last_seq = max(self.last_seq, self.reader.published)
+        return triggered_at
+
+    def end_triggered_capture(self):
+        self._call('end_triggered_capture')
+
+    def grab(self):
+        """Copy the next frame out of the acquisition ring. Returns a Frame or None."""
+        if not self.is_open:
+            return None
+        if not self.process.is_alive():
+            print("[ERROR] Acquisition process exited")
+            self.is_open = False
+            return None
+        shm_frame = self.reader.wait(self.last_seq, timeout=0.5)
+        if shm_frame is None:
+            return None
+        slot = self.pool.acquire()
+        if slot is None:
+            return None
+        src = shm_frame.image
+        image = self.pool.arrays[slot][:src.nbytes].reshape(src.shape)
+        np.copyto(image, src)
+        if not shm_frame.valid():
+            # The acquisition process lapped the ring mid-copy
+            self.pool.release(slot)
+            return None
+        self.last_seq = shm_frame.seq
+        return Frame(image, shm_frame.timestamp, shm_frame.captured_at,
+                     shm_frame.exposure_us, shm_frame.gain, shm_frame.binning,
+                     self.pool, slot, (shm_frame.offset_x, shm_frame.offset_y))
+
+    @property
+    def camera_type(self):
+        return self._camera_type
+
+
 # ============================================================================
 # Camera Server Application
 # ============================================================================
 
 app = Flask(__name__)
 CORS(app, origins="*", expose_headers=[
-    'X-Image-Width', 'X-Image-Height', 'X-Capture-Timestamp', 'X-Camera-Mode'
+    'X-Image-Width', 'X-Image-Height', 'X-Capture-Timestamp', 'X-Camera-Mode',
+    'X-Frame-Seq', 'X-Settle-Ms', 'X-Settle-Wait-Ms', 'X-Settle-Converged',
+    'X-Image-Stride', 'X-Pixel-Format', 'X-Capture-Trigger', 'X-Capture-Latency-Ms',
+    'X-Image-Offset-X', 'X-Image-Offset-Y', 'Server-Timing',
 ])  # Allow all origins; expose custom headers for browser JS
 
 # Global state
 camera = None
-current_mode = 'other'
-latest_frame = None
+# Resume in the mode the station was last using
+current_mode = camera_state.get('last_mode', 'other')
+if current_mode not in MODE_SETTINGS:
+    current_mode = 'other'
+latest_frame = None               # Most recent published Frame
+latest_seq = 0                    # Monotonic sequence of published frames
 frame_lock = threading.Lock()
+frame_cond = threading.Condition(frame_lock)  # Notified on every publish
 streaming = False
 stream_thread = None
-streaming_paused = False          # Pause streaming for exclusive capture
-mode_changed_at = 0.0             # Timestamp of last mode change
-MODE_SETTLE_TIME = 0.5            # Seconds to wait after mode change (per reference code)
+mode_changed_at = 0.0             # time.monotonic() of last mode change
+MODE_SETTLE_MAX_TIME = 1.5        # Ceiling on the adaptive settle wait after a mode change
+SETTLE_WINDOW = 3                 # Consecutive frames that must agree to count as settled
+SETTLE_TOLERANCE = 0.02           # Max relative change in brightness / exposure within the window
+CAPTURE_TIMEOUT = 3.0             # Max seconds to wait for a qualifying frame
 capture_lock = threading.Lock()   # Prevent concurrent captures
 
+# 'software': expose each capture on a software trigger (MindVision);
+# 'free': take the next qualifying frame of the free-running stream
+CAPTURE_TRIGGER = 'software'
+# Seconds without the triggered frame before triggering again
+TRIGGER_RETRY_AFTER = 1.0
+
+# Recent capture latencies per trigger mode, for /api/status
+capture_latencies = {'software': deque(maxlen=100), 'free': deque(maxlen=100)}
+capture_latency_lock = threading.Lock()
+
+# ============================================================================
+# Metrics (/api/metrics)
+# ============================================================================
+
+# Seconds over which magicqc_grab_fps is averaged
+GRAB_RATE_WINDOW = 5.0
+# Seconds a scrape reuses the camera's acquisition counters
+ACQUISITION_STATS_TTL = 1.0
+
+grab_times = deque(maxlen=1024)   # time.monotonic() of recent publishes
+_acquisition_stats = {'at': 0.0, 'stats': {}}
+_acquisition_stats_lock = threading.Lock()
+
+
+def scrape_acquisition_stats():
+    """camera.acquisition_stats(), cached briefly so one scrape asks once."""
+    with _acquisition_stats_lock:
+        now = time.monotonic()
+        if now - _acquisition_stats['at'] > ACQUISITION_STATS_TTL:
+            stats = {}
+            if camera and camera.is_open:
+                stats = camera.acquisition_stats() or {}
+            _acquisition_stats.update(at=now, stats=stats)
+        return _acquisition_stats['stats']
+
+
+def grab_rate():
+    now = time.monotonic()
+    recent = [t for t in list(grab_times) if now - t <= GRAB_RATE_WINDOW]
+    if len(recent) < 2:
+        return 0.0
+    return round((len(recent) - 1) / (recent[-1] - recent[0]), 2)
+
+
+def _stat_samples(*keys):
+    stats = scrape_acquisition_stats()
+    return {key.rsplit('_', 1)[-1]: stats[key] for key in keys if key in stats}
+
+
+FRAMES_GRABBED = counter('magicqc_frames_grabbed_total',
+                         'Frames published by the acquisition loop')
+gauge('magicqc_grab_fps', f'Published frames per second over the last {GRAB_RATE_WINDOW:g} s',
+      fn=grab_rate)
+GRAB_LATENCY = histogram('magicqc_grab_latency_seconds',
+                         'Sensor capture time to frame published')
+gauge('magicqc_camera_up', '1 while a camera is open',
+      fn=lambda: int(bool(camera and camera.is_open)))
+counter('magicqc_grab_timeouts_total', 'Grabs that timed out waiting for the SDK',
+        fn=lambda: scrape_acquisition_stats().get('grab_timeouts'))
+counter('magicqc_camera_errors_total', 'Grab failures by CameraException error code',
+        ['code'], fn=lambda: scrape_acquisition_stats().get('grab_errors'))
+counter('magicqc_acquisition_dropped_total',
+        'Frames skipped by acquisition (pool: every buffer leased, '
+        'queue: callback queue full)', ['reason'],
+        fn=lambda: {reason: value for reason, value in (
+            ('pool', scrape_acquisition_stats().get('pool_exhausted')),
+            ('queue', scrape_acquisition_stats().get('dropped'))) if value is not None})
+counter('magicqc_sdk_frames_total', 'CameraGetFrameStatistic frame counters',
+        ['kind'], fn=lambda: _stat_samples('sdk_frames_total', 'sdk_frames_captured',
+                                           'sdk_frames_lost'))
+ENCODE_SECONDS = histogram('magicqc_encode_seconds', 'Image encode time', ['kind'])
+gauge('magicqc_stream_clients', 'Connected stream clients',
+      fn=lambda: len(broadcaster.subscribers))
+STREAM_BYTES = counter('magicqc_stream_bytes_sent_total', 'Stream bytes sent to clients',
+                       ['transport'])
+STREAM_DROPPED = counter('magicqc_stream_frames_dropped_total',
+                         'Encoded frames dropped for clients that fell behind')
+CAPTURE_PHASE = histogram('magicqc_capture_phase_seconds',
+                          'Duration of each capture phase (and the total)', ['phase'])
+CAPTURE_TIMEOUTS = counter('magicqc_capture_timeouts_total',
+                           'Captures that got no qualifying frame in time')
+
+# JPEG backend for stream, preview and capture: 'auto' (libjpeg-turbo if
+# installed, else OpenCV), 'turbojpeg' or 'opencv'
+JPEG_ENCODER_BACKEND = 'auto'
+jpeg_encoder = get_encoder(JPEG_ENCODER_BACKEND)
+# Full-resolution captures are encoded as strips across all cores
+# (None = one worker per CPU)
+CAPTURE_ENCODE_WORKERS = None
+capture_encoder = ParallelJpegEncoder(jpeg_encoder, workers=CAPTURE_ENCODE_WORKERS)
+print(f"[INFO] JPEG encoder: {jpeg_encoder.name} "
+      f"(captures on {capture_encoder.workers} threads)")
+
+# Upper bound on memory held by already-encoded frames
+ENCODE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+class EncodedFrameCache:
+    """Size-capped LRU of encoded images keyed by (seq, scale, quality, format)."""
+
+    def __init__(self, max_bytes=ENCODE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return (data, meta) for *key*, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, data, meta=None):
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[0])
+            self.entries[key] = (data, meta or {})
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+encode_cache = EncodedFrameCache()
+
+
+def encode_cached(frame, quality, encoder=None, meta=None, kind='preview'):
+    """JPEG of *frame* through encode_cache. Returns (jpeg, meta)."""
+    key = (frame.seq, 1.0, quality, 'jpeg')
+    if frame.seq:
+        entry = encode_cache.get(key)
+        if entry is not None:
+            return entry
+    with ENCODE_SECONDS.time(kind=kind):
+        jpeg = (encoder or jpeg_encoder).encode(frame.image, quality)
+    meta = meta or {}
+    if frame.seq:
+        encode_cache.put(key, jpeg, meta)
+    return jpeg, meta
+
+
+class SettleDetector:
+    """Decides when brightness and exposure have settled after a mode change."""
+
+    def __init__(self, on_settled=None):
+        self.cond = threading.Condition()
+        self.changed_at = 0.0
+        self.settled_at = 0.0     # captured_at of the first stable frame
+        self.history = []
+        self.on_settled = on_settled
+
+    def reset(self, changed_at):
+        with self.cond:
+            self.changed_at = changed_at
+            self.settled_at = None
+            self.history = []
+
+    def observe(self, frame):
+        """Feed a streamed frame; cheap no-op once settled."""
+        with self.cond:
+            if self.settled_at is not None or frame.captured_at < self.changed_at:
+                return
+        brightness = float(frame.image[::16, ::16].mean())
+        with self.cond:
+            if self.settled_at is not None:
+                return
+            self.history.append((frame.captured_at, brightness, frame.exposure_us))
+            self.history = self.history[-SETTLE_WINDOW:]
+            if len(self.history) < SETTLE_WINDOW:
+                return
+            _, ref_brightness, ref_exposure = self.history[-1]
+            for _, b, e in self.history:
+                # Absolute floor of one grey level keeps dark scenes from
+                # never settling on sensor noise
+                if abs(b - ref_brightness) > max(SETTLE_TOLERANCE * ref_brightness, 1.0):
+                    return
+                if abs(e - ref_exposure) > SETTLE_TOLERANCE * ref_exposure:
+                    return
+            self.settled_at = self.history[0][0]
+            print(f"[INFO] Sensor settled in {(self.settled_at - self.changed_at) * 1000:.0f} ms")
+            self.cond.notify_all()
+        if self.on_settled:
+            self.on_settled()
+
+    def wait(self, timeout_at):
+        """Block until settled or *timeout_at*. Returns (settled_at, converged)."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.settled_at is not None,
+                               max(0.0, timeout_at - time.monotonic()))
+            if self.settled_at is not None:
+                return self.settled_at, True
+            return timeout_at, False
+
+
+def on_sensor_settled():
+    """Save the converged exposure into the mode's parameter group."""
+    if camera and camera.is_open:
+        camera.save_mode_state(current_mode)
+
+
+settle_detector = SettleDetector(on_settled=on_sensor_settled)
+
+
+def change_mode(mode):
+    """Apply a garment color mode and restart settle detection."""
+    global current_mode, mode_changed_at
+    current_mode = mode
+    mode_changed_at = time.monotonic()
+    settle_detector.reset(mode_changed_at)
+    if camera and camera.is_open:
+        camera.set_mode(mode)
+    if camera_state.get('last_mode') != mode:
+        update_camera_state('last_mode', mode)
+
 
 def init_camera():
     """Initialize the best available camera."""
     global camera
 
-    if MINDVISION_AVAILABLE:
-        camera = MindVisionCamera()
-        if camera.open():
-            camera.set_mode(current_mode)
-            return True
-        print("[WARN] MindVision camera failed, trying webcam fallback...")
+    camera = None
+    if ACQUISITION_PROCESS and SHM_AVAILABLE:
+        camera = ProcessCamera()
+        if not camera.open():
+            print("[WARN] Acquisition process failed, opening the camera in-process...")
+            camera = None
+    if camera is None:
+        camera = open_local_camera()
+
+    if camera is None:
+        print("[ERROR] No camera available!")
+        return False
+    change_mode(current_mode)
+    return True
+
+
+def publish_frame(frame):
+    """Make *frame* (the caller's reference) the latest frame and wake consumers."""
+    global latest_frame, latest_seq
+    with frame_cond:
+        latest_seq += 1
+        frame.seq = latest_seq
+        previous, latest_frame = latest_frame, frame
+        frame_cond.notify_all()
+    if previous is not None:
+        previous.release()
+    now = time.monotonic()
+    grab_times.append(now)
+    FRAMES_GRABBED.inc()
+    GRAB_LATENCY.observe(max(0.0, now - frame.captured_at))
+
+
+def clear_latest_frame():
+    """Drop the latest frame, e.g. after camera settings change."""
+    global latest_frame
+    with frame_cond:
+        previous, latest_frame = latest_frame, None
+    if previous is not None:
+        previous.release()
+
+
+def acquire_latest():
+    """Lease the latest frame. Returns a Frame the caller must release."""
+    with frame_lock:
+        return latest_frame.retain() if latest_frame is not None else None
 
-    camera = WebcamCamera(0)
-    if camera.open():
-        camera.set_mode(current_mode)
-        return True
 
-    print("[ERROR] No camera available!")
-    camera = None
+def wait_for_frame(after_seq, timeout=1.0):
+    """Leased frame newer than *after_seq*, or None on timeout or stop."""
+    def ready():
+        return latest_frame is not None and latest_frame.seq > after_seq
+
+    with frame_cond:
+        frame_cond.wait_for(lambda: ready() or not streaming, timeout)
+        return latest_frame.retain() if ready() else None
+
+
+def capture_frame(not_before, timeout=CAPTURE_TIMEOUT):
+    """First full-resolution frame captured after *not_before*. Returns (frame, timing)."""
+    start_streaming()
+    deadline = time.monotonic() + timeout
+    seq = 0
+    skipped = 0
+    retriggers = 0
+    camera.set_capture_resolution(True)
+    triggered_at = None
+    if CAPTURE_TRIGGER == 'software':
+        triggered_at = camera.begin_triggered_capture()
+    if triggered_at is not None:
+        seq = latest_seq
+        retrigger_at = time.monotonic() + TRIGGER_RETRY_AFTER
+    start = triggered_at if triggered_at is not None else time.monotonic()
+    frame = None
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wait_until = deadline
+            if triggered_at is not None:
+                if now >= retrigger_at:
+                    print("[WARN] Triggered frame did not arrive; triggering again")
+                    if camera.begin_triggered_capture() is None:
+                        break
+                    seq = latest_seq
+                    retriggers += 1
+                    retrigger_at = time.monotonic() + TRIGGER_RETRY_AFTER
+                wait_until = min(deadline, retrigger_at)
+            frame = wait_for_frame(seq, max(0.0, wait_until - time.monotonic()))
+            if frame is None:
+                if triggered_at is None or not streaming:
+                    break
+                continue
+            if frame.binning == 1 and (triggered_at is not None or
+                                       frame.captured_at >= not_before):
+                break
+            seq = frame.seq
+            skipped += 1
+            frame.release()
+            frame = None
+    finally:
+        if triggered_at is not None:
+            camera.end_triggered_capture()
+        camera.set_capture_resolution(False)
+
+    timing = {
+        'trigger': 'software' if triggered_at is not None else 'free',
+        'capture_latency_ms': round((time.monotonic() - start) * 1000, 1),
+        'skipped_frames': skipped,
+        'retriggers': retriggers,
+        'exposure_ms': round(frame.exposure_us / 1000, 2) if frame else None,
+    }
+    if frame is not None:
+        record_capture_latency(timing)
+    return frame, timing
+
+
+def record_capture_latency(timing):
+    with capture_latency_lock:
+        capture_latencies[timing['trigger']].append(timing['capture_latency_ms'])
+
+
+def capture_latency_stats():
+    """Summary of recent capture latencies per trigger mode, for /api/status."""
+    with capture_latency_lock:
+        return {
+            mode: {
+                'count': len(values),
+                'last_ms': values[-1],
+                'mean_ms': round(sum(values) / len(values), 1),
+                'max_ms': max(values),
+            }
+            for mode, values in capture_latencies.items() if values
+        }
+
+
+# Captures kept for the /api/capture/stats percentiles
+CAPTURE_STATS_WINDOW = 200
+CAPTURE_STATS_PERCENTILES = (50, 90, 99)
+
+capture_phase_samples = deque(maxlen=CAPTURE_STATS_WINDOW)   # {phase: ms}
+capture_phase_lock = threading.Lock()
+
+
+class CaptureTimer:
+    """Per-phase durations of one capture request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}          # name -> seconds, in the order first seen
+        self.total = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def finish(self):
+        if self.total is not None:
+            return self
+        self.total = time.perf_counter() - self.start
+        for name, seconds in self.phases.items():
+            CAPTURE_PHASE.observe(seconds, phase=name)
+        CAPTURE_PHASE.observe(self.total, phase='total')
+        sample = {name: seconds * 1000 for name, seconds in self.phases.items()}
+        sample['total'] = self.total * 1000
+        with capture_phase_lock:
+            capture_phase_samples.append(sample)
+        return self
+
+    def as_dict(self):
+        """{'<phase>_ms': ..., 'total_ms': ...} for JSON responses."""
+        timing = {f'{name}_ms': round(seconds * 1000, 1)
+                  for name, seconds in self.phases.items()}
+        timing['total_ms'] = round(self.finish().total * 1000, 1)
+        return timing
+
+    def header(self):
+        """Server-Timing header value, durations in milliseconds."""
+        entries = [f'{name};dur={seconds * 1000:.1f}'
+                   for name, seconds in self.phases.items()]
+        entries.append(f'total;dur={self.finish().total * 1000:.1f}')
+        return ', '.join(entries)
+
+
+def timed_response(response, timer):
+    """Attach *timer*'s Server-Timing header to a capture response."""
+    response.headers['Server-Timing'] = timer.header()
+    return response
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list."""
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def capture_phase_stats():
+    """Rolling percentiles of each capture phase, in milliseconds."""
+    with capture_phase_lock:
+        samples = list(capture_phase_samples)
+    phases = {}
+    for sample in samples:
+        for name, ms in sample.items():
+            phases.setdefault(name, []).append(ms)
+    stats = {}
+    for name, values in phases.items():
+        values.sort()
+        stats[name] = {
+            'count': len(values),
+            'mean_ms': round(sum(values) / len(values), 1),
+            **{f'p{p}_ms': round(percentile(values, p), 1)
+               for p in CAPTURE_STATS_PERCENTILES},
+            'max_ms': round(values[-1], 1),
+        }
+    return {'captures': len(samples), 'phases': stats}
+
+
+def apply_capture_mode(req_mode):
+    """Switch to *req_mode* if needed; True if the mode changed."""
+    if req_mode in ('black', 'white', 'other') and req_mode != current_mode:
+        change_mode(req_mode)
+        return True
     return False
 
 
+def wait_for_settle():
+    """Block until the sensor has settled. Returns (settled_at, timings)."""
+    waited_from = time.monotonic()
+    settled_at, converged = settle_detector.wait(
+        mode_changed_at + MODE_SETTLE_MAX_TIME)
+    return settled_at, {
+        'settle_ms': round((settled_at - mode_changed_at) * 1000, 1),
+        'settle_wait_ms': round((time.monotonic() - waited_from) * 1000, 1),
+        'settle_converged': converged,
+    }
+
+
+def take_capture(req_mode, timer):
+    """Apply the mode, wait for settle, take a frame. Returns (frame, settle)."""
+    with timer.phase('lock'):
+        capture_lock.acquire()
+    try:
+        requested_at = time.monotonic()
+        with timer.phase('mode'):
+            if apply_capture_mode(req_mode):
+                print(f"[CAPTURE] Mode force-set to '{current_mode}' via capture param")
+
+        with timer.phase('settle_wait'):
+            settled_at, settle = wait_for_settle()
+        if settle['settle_wait_ms'] > 0.5:
+            print(f"[CAPTURE] Waited {settle['settle_wait_ms']:.0f} ms for mode to stabilize")
+        with timer.phase('frame'):
+            frame, timing = capture_frame(max(requested_at, settled_at))
+        if frame is None:
+            CAPTURE_TIMEOUTS.inc()
+        return frame, {**settle, **timing}
+    finally:
+        capture_lock.release()
+
+
 def stream_worker():
     """Background thread that continuously grabs frames for streaming."""
-    global latest_frame, streaming
     while streaming and camera and camera.is_open:
-        if streaming_paused:
-            time.sleep(0.01)  # Yield camera access during capture
-            continue
         frame = camera.grab()
         if frame is not None:
-            with frame_lock:
-                latest_frame = frame
+            settle_detector.observe(frame)
+            publish_frame(frame)
         else:
             time.sleep(0.005)  # Brief pause only on failed grabs
 
 
+# Publish every streamed frame (binned preview, binning == 1 for captures)
+# into the shared-memory ring; a ProcessCamera fills it itself
+SHM_PUBLISH = True
+shm_publisher = None
+shm_thread = None
+
+
+def shm_publish_worker():
+    """Copy each published frame into the shared-memory ring."""
+    global shm_publisher
+    seq = 0
+    while streaming:
+        frame = wait_for_frame(seq, timeout=0.5)
+        if frame is None:
+            continue
+        seq = frame.seq
+        with frame:
+            if shm_publisher is None:
+                # Size slots for the largest frame the camera can deliver
+                pool = getattr(camera, 'pool', None)
+                slot_size = max(pool.size if pool else 0, frame.image.nbytes)
+                try:
+                    shm_publisher = FramePublisher(slot_size)
+                except OSError as e:
+                    print(f"[WARN] Could not create shared-memory frame ring: {e}")
+                    return
+                print(f"[INFO] Publishing frames to shared memory "
+                      f"'{shm_publisher.name}' ({slot_size // 1024} KB slots, "
+                      f"streamed resolution)")
+            shm_publisher.publish(frame.image, frame.seq, frame.timestamp,
+                                  frame.captured_at, frame.exposure_us,
+                                  frame.gain, frame.binning, current_mode,
+                                  (frame.offset_x, frame.offset_y))
+
+
+# Raw frame recordings (see frame_recorder.py); replay one with
+# MAGICQC_SIMULATED_CAMERA=<recording file>
+RECORDINGS_PATH = os.path.join(_project_root, 'storage', 'app', 'recordings')
+recorder = None
+recorder_thread = None
+recorder_stop = threading.Event()
+recorder_lock = threading.Lock()
+
+
+def recorder_worker(rec, stop):
+    """Append each published frame to *rec* until stopped or the file is full."""
+    seq = 0
+    try:
+        while streaming and not stop.is_set():
+            frame = wait_for_frame(seq, timeout=0.5)
+            if frame is None:
+                continue
+            seq = frame.seq
+            with frame:
+                if frame.image.ndim != 2:
+                    print("[WARN] Only MONO8 frames can be recorded; recording stopped")
+                    break
+                if not rec.record(frame.image, frame.seq, frame.timestamp,
+                                  frame.captured_at, frame.exposure_us,
+                                  frame.gain, frame.binning, current_mode,
+                                  (frame.offset_x, frame.offset_y)):
+                    print(f"[INFO] Recording full after {rec.count} frames")
+                    break
+    finally:
+        rec.close()
+        print(f"[INFO] Recording saved: {rec.path} ({rec.count} frames, "
+              f"{rec.used // (1024 * 1024)} MB)")
+
+
+def start_recording(name, max_bytes=RECORDER_MAX_BYTES):
+    """Start recording into RECORDINGS_PATH/<name>.mqrec. Returns the recorder."""
+    global recorder, recorder_thread, recorder_stop
+    with recorder_lock:
+        if recorder_thread is not None and recorder_thread.is_alive():
+            raise RuntimeError('A recording is already running')
+        path = os.path.join(RECORDINGS_PATH, name + RECORDING_EXTENSION)
+        if os.path.exists(path):
+            raise FileExistsError(path)
+        recorder = FrameRecorder(path, max_bytes)
+        recorder_stop = threading.Event()
+        start_streaming()
+        recorder_thread = threading.Thread(target=recorder_worker,
+                                           args=(recorder, recorder_stop),
+                                           daemon=True)
+        recorder_thread.start()
+        print(f"[INFO] Recording to {path} (up to {max_bytes // (1024 * 1024)} MB)")
+        return recorder
+
+
+def stop_recording():
+    """Stop the running recording, if any, and wait for the file to close."""
+    with recorder_lock:
+        recorder_stop.set()
+        if recorder_thread is not None:
+            recorder_thread.join(timeout=5)
+
+
+def recording_status():
+    if recorder is None:
+        return None
+    return {
+        'path': os.path.relpath(recorder.path, _project_root).replace(os.sep, '/'),
+        'active': recorder_thread is not None and recorder_thread.is_alive(),
+        'frames': recorder.count,
+        'bytes': recorder.used,
+    }
+
+
 def start_streaming():
     """Start the background frame-grabbing thread."""
-    global streaming, stream_thread
+    global streaming, stream_thread, shm_thread
     if streaming:
         return
     streaming = True
     stream_thread = threading.Thread(target=stream_worker, daemon=True)
     stream_thread.start()
+    # A ProcessCamera's acquisition process already publishes to the ring
+    if SHM_PUBLISH and SHM_AVAILABLE and not isinstance(camera, ProcessCamera):
+        shm_thread = threading.Thread(target=shm_publish_worker, daemon=True)
+        shm_thread.start()
     print("[INFO] Streaming started")
 
 
@@ -332,36 +2119,205 @@ def stop_streaming():
     """Stop the background streaming thread."""
     global streaming
     streaming = False
+    with frame_cond:
+        frame_cond.notify_all()
     if stream_thread:
         stream_thread.join(timeout=2)
+    if shm_thread:
+        shm_thread.join(timeout=2)
+    if recorder_thread:
+        recorder_thread.join(timeout=5)
     print("[INFO] Streaming stopped")
 
 
 # Downscale factor for MJPEG streaming (full-res is 5456x2812 = too slow)
 # Capture always uses full resolution.
 STREAM_SCALE = 0.25   # 1364x703 — fast enough for smooth live preview
+STREAM_QUALITY = 70
+STREAM_MAX_FPS = 60   # Upper bound for the per-client ?fps= throttle
+
+
+# Encoded frames waiting per stream client. When a client falls behind,
+# the oldest queued frame is dropped so it always gets the newest one.
+STREAM_QUEUE_DEPTH = 2
+
+# WebSocket header before the JPEG: version u8, seq u32, captured_at f64
+# (Unix s; the sensor clock resets), width u16, height u16, mode u8 (MODES)
+WS_HEADER = struct.Struct('<BIdHHB')
+WS_HEADER_VERSION = 2
+
+
+class EncodedFrame:
+    """A stream JPEG plus the frame metadata sent alongside it."""
+
+    __slots__ = ('seq', 'captured_at', 'width', 'height', 'mode', 'jpeg')
+
+    def __init__(self, seq, captured_at, width, height, mode, jpeg):
+        self.seq = seq
+        self.captured_at = captured_at   # Unix seconds
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.jpeg = jpeg
+
+    def ws_message(self):
+        """Header + JPEG as one binary WebSocket message."""
+        return WS_HEADER.pack(WS_HEADER_VERSION, self.seq & 0xFFFFFFFF,
+                              self.captured_at, self.width, self.height,
+                              mode_index(self.mode)) + self.jpeg
 
 
-def generate_mjpeg():
+class StreamProfile:
+    """What a stream client asked for: scale, JPEG quality and frame rate."""
+
+    __slots__ = ('scale', 'quality', 'fps')
+
+    def __init__(self, scale=STREAM_SCALE, quality=STREAM_QUALITY, fps=None):
+        self.scale = scale
+        self.quality = quality
+        self.fps = fps
+
+    @property
+    def key(self):
+        return (self.scale, self.quality)
+
+    @classmethod
+    def from_args(cls, args):
+        """Build a profile from ?scale=&quality=&fps=. Raises ValueError."""
+        scale = float(args.get('scale', STREAM_SCALE))
+        quality = int(args.get('quality', STREAM_QUALITY))
+        fps = args.get('fps')
+        fps = float(fps) if fps else None
+        if not 0.05 <= scale <= 1.0:
+            raise ValueError('scale must be between 0.05 and 1.0')
+        if not 10 <= quality <= 100:
+            raise ValueError('quality must be between 10 and 100')
+        if fps is not None and not 0 < fps <= STREAM_MAX_FPS:
+            raise ValueError(f'fps must be between 0 and {STREAM_MAX_FPS}')
+        return cls(round(scale, 2), quality, fps)
+
+
+class StreamSubscriber:
+    """Bounded per-client queue of encoded frames (drop-oldest)."""
+
+    def __init__(self, profile, depth=STREAM_QUEUE_DEPTH):
+        self.profile = profile
+        self.queue = deque(maxlen=depth)
+        self.dropped = 0
+        self.next_due = 0.0
+
+    def take_if_due(self, captured_at):
+        """True if a frame captured at *captured_at* is due for this client."""
+        if self.profile.fps is None:
+            return True
+        interval = 1.0 / self.profile.fps
+        if captured_at < self.next_due - interval * 0.25:
+            return False
+        self.next_due = max(self.next_due, captured_at) + interval
+        return True
+
+
+def encode_stream_jpeg(frame, scale, quality):
+    """Resize *frame* to *scale* of the sensor and encode. Returns (jpeg, w, h)."""
+    image = frame.image
+    scale = scale * frame.binning
+    if scale < 1:
+        h, w = image.shape[:2]
+        image = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))),
+                           interpolation=cv2.INTER_NEAREST)
+    h, w = image.shape[:2]
+    with ENCODE_SECONDS.time(kind='stream'):
+        jpeg = jpeg_encoder.encode(image, quality)
+    return jpeg, w, h
+
+
+class MjpegBroadcaster:
+    """Encodes each preview frame once per profile and fans it out to clients."""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.subscribers = set()
+        self.thread = None
+
+    def subscribe(self, profile=None):
+        sub = StreamSubscriber(profile or StreamProfile())
+        with self.cond:
+            self.subscribers.add(sub)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._encode_loop,
+                                               daemon=True)
+                self.thread.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.cond:
+            self.subscribers.discard(sub)
+        if sub.dropped:
+            print(f"[INFO] Stream client left ({sub.dropped} frames dropped)")
+
+    def next_frame(self, sub, timeout=1.0):
+        """Pop the oldest queued EncodedFrame for *sub*, or None on timeout."""
+        with self.cond:
+            self.cond.wait_for(lambda: sub.queue or not streaming, timeout)
+            if not sub.queue:
+                return None
+            return sub.queue.popleft()
+
+    def _encode_loop(self):
+        seq = 0
+        while streaming:
+            with self.cond:
+                if not self.subscribers:
+                    self.thread = None
+                    return
+            frame = wait_for_frame(seq, timeout=0.5)
+            if frame is None:
+                continue
+            seq = frame.seq
+            with frame:
+                groups = {}
+                with self.cond:
+                    for sub in self.subscribers:
+                        if sub.take_if_due(frame.captured_at):
+                            groups.setdefault(sub.profile.key, []).append(sub)
+                if not groups:
+                    continue
+                encoded = {}
+                for scale, quality in groups:
+                    jpeg, w, h = encode_stream_jpeg(frame, scale, quality)
+                    encoded[(scale, quality)] = EncodedFrame(
+                        seq, to_epoch(frame.captured_at), w, h, current_mode, jpeg)
+            with self.cond:
+                for key, subs in groups.items():
+                    for sub in subs:
+                        if len(sub.queue) == sub.queue.maxlen:
+                            sub.dropped += 1
+                            STREAM_DROPPED.inc()
+                        sub.queue.append(encoded[key])
+                self.cond.notify_all()
+        with self.cond:
+            self.thread = None
+            self.cond.notify_all()
+
+
+broadcaster = MjpegBroadcaster()
+
+
+def generate_mjpeg(profile=None):
     """Generator that yields MJPEG frames for streaming."""
-    prev_id = None
-    while streaming:
-        with frame_lock:
-            frame = latest_frame
-        fid = id(frame)
-        if frame is not None and fid != prev_id:
-            # Downsample for streaming speed
-            h, w = frame.shape[:2]
-            small = cv2.resize(frame, (int(w * STREAM_SCALE), int(h * STREAM_SCALE)),
-                               interpolation=cv2.INTER_NEAREST)
-            _, jpeg = cv2.imencode('.jpg', small,
-                                   [cv2.IMWRITE_JPEG_QUALITY, 70])
-            prev_id = fid
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' +
-                   jpeg.tobytes() + b'\r\n')
-        else:
-            time.sleep(0.016)  # ~60fps cap
+    sub = broadcaster.subscribe(profile)
+    try:
+        while streaming:
+            encoded = broadcaster.next_frame(sub)
+            if encoded is None:
+                continue
+            chunk = (b'--frame\r\n'
+                     b'Content-Type: image/jpeg\r\n\r\n' +
+                     encoded.jpeg + b'\r\n')
+            STREAM_BYTES.inc(len(chunk), transport='mjpeg')
+            yield chunk
+    finally:
+        broadcaster.unsubscribe(sub)
 
 
 # ============================================================================
@@ -376,6 +2332,12 @@ def status():
         'camera_type': camera.camera_type if camera else None,
         'current_mode': current_mode,
         'streaming': streaming,
+        'encode_cache': encode_cache.stats(),
+        'shared_memory': shm_publisher.name if shm_publisher else None,
+        'acquisition': camera.acquisition_stats() if camera else None,
+        'capture_latency': capture_latency_stats(),
+        'roi': list(camera.roi) if camera and getattr(camera, 'roi', None) else None,
+        'recording': recording_status(),
         'server': 'MagicQC Camera Server v1.0',
     })
 
@@ -386,172 +2348,488 @@ def ping():
     return '', 200
 
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text-format metrics (grab rate, latencies, drops, clients)."""
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route('/api/record', methods=['GET', 'POST', 'DELETE'])
+def record():
+    """Record raw frames for replay: POST starts, DELETE stops, GET reports."""
+    if request.method == 'GET':
+        return jsonify({'recording': recording_status()})
+    if request.method == 'DELETE':
+        stop_recording()
+        return jsonify({'success': True, 'recording': recording_status()})
+
+    if not camera or not camera.is_open:
+        return jsonify({'error': 'Camera not available'}), 503
+    data = request.get_json(silent=True) or {}
+    name = safe_path_component(data.get('name') or
+                               datetime.now().strftime('recording_%Y%m%d_%H%M%S'))
+    if not name:
+        return jsonify({'error': 'Invalid recording name'}), 400
+    try:
+        max_bytes = int(float(data.get('max_mb', RECORDER_MAX_BYTES / (1024 * 1024)))
+                        * 1024 * 1024)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'max_mb must be a number'}), 400
+    if max_bytes <= 0:
+        return jsonify({'error': 'max_mb must be positive'}), 400
+    try:
+        start_recording(name, max_bytes)
+    except (RuntimeError, FileExistsError) as e:
+        return jsonify({'error': f'Cannot start recording: {e}'}), 409
+    except OSError as e:
+        return jsonify({'error': f'Cannot create recording: {e}'}), 500
+    return jsonify({'success': True, 'recording': recording_status()})
+
+
 @app.route('/api/mode', methods=['POST'])
 def set_mode():
     """Set garment color mode (black, white, or other)."""
-    global current_mode, mode_changed_at, latest_frame
     data = request.get_json(silent=True) or {}
     mode = data.get('mode', 'other')
 
     if mode not in ('black', 'white', 'other'):
         return jsonify({'error': 'Invalid mode. Use "black", "white", or "other".'}), 400
 
-    current_mode = mode
-    mode_changed_at = time.time()
-
-    if camera and camera.is_open:
-        camera.set_mode(mode)
+    change_mode(mode)
 
     # Clear cached frame so streaming picks up fresh frames with new settings
-    with frame_lock:
-        latest_frame = None
+    clear_latest_frame()
 
-    print(f"[INFO] Mode changed to '{mode}' — camera needs ~{MODE_SETTLE_TIME}s to stabilize")
+    print(f"[INFO] Mode changed to '{mode}' — waiting for sensor to settle (max {MODE_SETTLE_MAX_TIME}s)")
 
-    mode_settings = {
-        'black': {'gain': 150, 'auto_exposure': 'OFF'},
-        'white': {'gain': 20, 'auto_exposure': 'ON'},
-        'other': {'gain': 64, 'auto_exposure': 'ON'},
-    }
+    settings = MODE_SETTINGS[mode]
 
     return jsonify({
         'success': True,
         'mode': current_mode,
-        'settings': mode_settings.get(mode, mode_settings['other']),
+        'settings': {
+            'gain': settings['gain'],
+            'auto_exposure': 'ON' if settings['auto_exposure'] else 'OFF',
+        },
     })
 
 
 @app.route('/api/stream', methods=['GET'])
 def video_stream():
-    """MJPEG live stream endpoint."""
+    """MJPEG live stream endpoint (optional ?scale=, ?quality=, ?fps=)."""
     if not camera or not camera.is_open:
         return jsonify({'error': 'Camera not available'}), 503
 
+    try:
+        profile = StreamProfile.from_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     start_streaming()
-    return Response(generate_mjpeg(),
+    return Response(generate_mjpeg(profile),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
+if WEBSOCKET_AVAILABLE:
+    sock = Sock(app)
+
+    @sock.route('/api/ws/stream')
+    def ws_stream(ws):
+        """WebSocket live stream: one binary message (WS_HEADER + JPEG) per frame."""
+        if not camera or not camera.is_open:
+            ws.close(reason=1011, message='Camera not available')
+            return
+        try:
+            profile = StreamProfile.from_args(request.args)
+        except ValueError as e:
+            ws.close(reason=1008, message=str(e))
+            return
+
+        start_streaming()
+        sub = broadcaster.subscribe(profile)
+        try:
+            while streaming:
+                encoded = broadcaster.next_frame(sub)
+                if encoded is None:
+                    continue
+                message = encoded.ws_message()
+                ws.send(message)
+                STREAM_BYTES.inc(len(message), transport='websocket')
+        except ConnectionClosed:
+            pass
+        finally:
+            broadcaster.unsubscribe(sub)
+
+
+# JPEG quality of full-resolution captures (also part of their encode_cache key)
+CAPTURE_QUALITY = 95
+
+
+def encode_capture(frame, timer):
+    """Capture JPEG of the leased *frame*, cached. Returns (jpeg, meta)."""
+    h, w = frame.image.shape[:2]
+    with timer.phase('encode'):
+        return encode_cached(frame, CAPTURE_QUALITY, capture_encoder, {
+            'width': w, 'height': h, 'mode': current_mode,
+            'timestamp': datetime.now().strftime('%Y%m%d_%H%M%S'),
+        }, kind='capture')
+
+
+def capture_headers(frame, settle, timestamp=None):
+    """Response headers describing a captured *frame* and its settle info."""
+    h, w = frame.image.shape[:2]
+    return {
+        'X-Image-Width': str(w),
+        'X-Image-Height': str(h),
+        'X-Capture-Timestamp': timestamp or datetime.now().strftime('%Y%m%d_%H%M%S'),
+        'X-Camera-Mode': current_mode,
+        'X-Image-Offset-X': str(frame.offset_x),
+        'X-Image-Offset-Y': str(frame.offset_y),
+        'X-Frame-Seq': str(frame.seq),
+        'X-Settle-Ms': str(settle['settle_ms']),
+        'X-Settle-Wait-Ms': str(settle['settle_wait_ms']),
+        'X-Settle-Converged': '1' if settle['settle_converged'] else '0',
+        'X-Capture-Trigger': settle['trigger'],
+        'X-Capture-Latency-Ms': str(settle['capture_latency_ms']),
+        'Cache-Control': 'no-cache',
+    }
+
+
 @app.route('/api/capture', methods=['POST'])
 def capture():
     """Capture a single high-quality frame and return as base64 JPEG.
     (Legacy endpoint — prefer /api/capture-jpeg for speed.)"""
-    global current_mode, mode_changed_at, streaming_paused
-
     if not camera or not camera.is_open:
         return jsonify({'error': 'Camera not available'}), 503
 
-    with capture_lock:
-        data = request.get_json(silent=True) or {}
-        req_mode = data.get('mode', current_mode)
-        if req_mode in ('black', 'white', 'other') and req_mode != current_mode:
-            current_mode = req_mode
-            camera.set_mode(current_mode)
-            mode_changed_at = time.time()
-
-        # Stabilize
-        elapsed = time.time() - mode_changed_at
-        if 0 < elapsed < MODE_SETTLE_TIME:
-            time.sleep(MODE_SETTLE_TIME - elapsed)
-
-        # Pause streaming and do fresh grab
-        streaming_paused = True
-        time.sleep(0.02)
-        try:
-            camera.grab()  # flush
-            frame = camera.grab()
-        finally:
-            streaming_paused = False
+    data = request.get_json(silent=True) or {}
+    timer = CaptureTimer()
+    frame, settle = take_capture(data.get('mode', current_mode), timer)
 
     if frame is None:
-        return jsonify({'error': 'Failed to capture frame'}), 500
+        return timed_response(jsonify({'error': 'Failed to capture frame'}),
+                              timer.finish()), 500
 
-    _, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
-    b64 = base64.b64encode(jpeg.tobytes()).decode('utf-8')
+    with frame:
+        jpeg, meta = encode_capture(frame, timer)
+    b64 = base64.b64encode(jpeg).decode('utf-8')
+    timer.finish()
 
-    h, w = frame.shape[:2]
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-
-    return jsonify({
+    return timed_response(jsonify({
         'success': True,
         'image': b64,
-        'width': w,
-        'height': h,
+        'width': meta['width'],
+        'height': meta['height'],
         'mode': current_mode,
-        'timestamp': timestamp,
+        'timestamp': meta['timestamp'],
+        'frame_seq': frame.seq,
         'camera_type': camera.camera_type,
-    })
+        'offset_x': frame.offset_x,
+        'offset_y': frame.offset_y,
+        **settle,
+        'timing': timer.as_dict(),
+    }), timer)
 
 
 @app.route('/api/capture-jpeg', methods=['GET'])
 def capture_jpeg():
-    """High-quality capture — returns raw JPEG binary with metadata in headers.
+    """High-quality capture — returns raw JPEG binary with metadata in headers."""
+    if not camera or not camera.is_open:
+        return jsonify({'error': 'Camera not available'}), 503
+
+    # Accept optional mode parameter — frontend sends its expected mode
+    # so we can verify / re-apply if needed.
+    timer = CaptureTimer()
+    frame, settle = take_capture(request.args.get('mode', current_mode), timer)
+
+    if frame is None:
+        return timed_response(jsonify({'error': 'Failed to capture frame'}),
+                              timer.finish()), 500
+
+    with frame:
+        jpeg, meta = encode_capture(frame, timer)
+        headers = capture_headers(frame, settle, meta['timestamp'])
+    headers['Server-Timing'] = timer.finish().header()
+    return Response(jpeg, mimetype='image/jpeg', headers=headers)
+
+
+# Max seconds /api/capture-to-storage waits for the file to hit the disk
+STORAGE_WRITE_TIMEOUT = 10.0
 
-    Uses the same pattern as the reference capture code:
-      1. Apply / confirm camera mode settings
-      2. Wait for sensor to stabilize (gain + auto-exposure)
-      3. Flush stale frames from the camera buffer
-      4. Grab a fresh frame
-    """
-    global current_mode, mode_changed_at, streaming_paused
 
+@app.route('/api/capture-to-storage', methods=['POST'])
+def capture_to_storage():
+    """Capture into annotations/{style}/{style}_{size}.jpg in storage.
+    JSON: article_style, size, mode, wait (true), overwrite (false)."""
     if not camera or not camera.is_open:
         return jsonify({'error': 'Camera not available'}), 503
 
-    with capture_lock:
-        # Accept optional mode parameter — frontend sends its expected mode
-        # so we can verify / re-apply if needed.
-        req_mode = request.args.get('mode', current_mode)
-        if req_mode in ('black', 'white', 'other') and req_mode != current_mode:
-            current_mode = req_mode
-            camera.set_mode(current_mode)
-            mode_changed_at = time.time()
-            print(f"[CAPTURE] Mode force-set to '{current_mode}' via capture param")
-
-        # Wait for mode to stabilize if recently changed (per reference code)
-        elapsed = time.time() - mode_changed_at
-        if 0 < elapsed < MODE_SETTLE_TIME:
-            wait = MODE_SETTLE_TIME - elapsed
-            print(f"[CAPTURE] Waiting {wait:.2f}s for mode to stabilize...")
-            time.sleep(wait)
-
-        # Pause streaming to get exclusive camera access
-        streaming_paused = True
-        time.sleep(0.02)  # Let current stream grab finish
+    data = request.get_json(silent=True) or {}
+    style = safe_path_component(data.get('article_style', ''))
+    size = safe_path_component(data.get('size', ''))
+    if not style or not size:
+        return jsonify({'error': 'article_style and size are required'}), 400
+
+    if getattr(camera, 'roi', None):
+        return jsonify({'error': 'A readout ROI is set; clear it with '
+                                 'DELETE /api/measurement-roi first'}), 409
+
+    relative_path = f"annotations/{style}/{style}_{size}.jpg"
+    target = os.path.join(STORAGE_PUBLIC_PATH, *relative_path.split('/'))
+    if os.path.exists(target) and not json_flag(data.get('overwrite')):
+        return jsonify({'error': f'{relative_path} already exists; '
+                                 'pass "overwrite": true to replace it',
+                        'path': relative_path}), 409
+
+    timer = CaptureTimer()
+    frame, settle = take_capture(data.get('mode', current_mode), timer)
+    if frame is None:
+        return timed_response(jsonify({'error': 'Failed to capture frame'}),
+                              timer.finish()), 500
 
-        try:
-            # Flush one stale frame then grab fresh
-            camera.grab()
-            frame = camera.grab()
-        finally:
-            # Always resume streaming
-            streaming_paused = False
+    with frame:
+        jpeg, meta = encode_capture(frame, timer)
+
+    future = storage_writer.submit(target, jpeg)
+
+    result = {
+        'success': True,
+        'path': relative_path,
+        'width': meta['width'],
+        'height': meta['height'],
+        'bytes': len(jpeg),
+        'mode': current_mode,
+        'timestamp': meta['timestamp'],
+        'frame_seq': frame.seq,
+        'camera_type': camera.camera_type,
+        'offset_x': frame.offset_x,
+        'offset_y': frame.offset_y,
+        **settle,
+    }
+    if not json_flag(data.get('wait'), default=True):
+        timer.finish()
+        return timed_response(jsonify({**result, 'written': False,
+                                       'timing': timer.as_dict()}), timer), 202
+
+    try:
+        with timer.phase('write'):
+            future.result(timeout=STORAGE_WRITE_TIMEOUT)
+    except FutureTimeout:
+        timer.finish()
+        return timed_response(jsonify({**result, 'written': False,
+                                       'timing': timer.as_dict()}), timer), 202
+    except OSError as e:
+        print(f"[ERROR] Failed to write {relative_path}: {e}")
+        return timed_response(jsonify({'error': f'Failed to write image: {e}'}),
+                              timer.finish()), 500
+    print(f"[CAPTURE] Saved {relative_path} ({len(jpeg) // 1024} KB)")
+    timer.finish()
+    return timed_response(jsonify({**result, 'written': True,
+                                   'timing': timer.as_dict()}), timer)
+
+
+# Extra room around the placement box, as a fraction of its size
+MEASUREMENT_ROI_MARGIN = 0.10
+
+
+def load_placement_box(style, size):
+    """(placement_box, image_dimensions) from an ImageAnnotator JSON, or None."""
+    json_path = os.path.join(STORAGE_PUBLIC_PATH, 'annotations', style,
+                             f"{style}_{size}.json")
+    try:
+        with open(json_path, 'r') as f:
+            annotation = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return annotation.get('placement_box'), annotation.get('image_dimensions')
+
+
+@app.route('/api/measurement-roi', methods=['POST', 'DELETE'])
+def measurement_roi():
+    """Limit the sensor readout to an annotation's placement box (DELETE clears).
+    JSON: article_style and size, or placement_box and image_dimensions."""
+    if not camera or not camera.is_open:
+        return jsonify({'error': 'Camera not available'}), 503
+
+    if request.method == 'DELETE':
+        camera.set_roi(None)
+        clear_latest_frame()
+        print("[INFO] Measurement ROI cleared")
+        return jsonify({'success': True, 'roi': None})
+
+    data = request.get_json(silent=True) or {}
+    box = data.get('placement_box')
+    dims = data.get('image_dimensions')
+    source = 'request'
+    if box is None:
+        style = safe_path_component(data.get('article_style', ''))
+        size = safe_path_component(data.get('size', ''))
+        if not style or not size:
+            return jsonify({'error': 'placement_box or article_style and size are required'}), 400
+        loaded = load_placement_box(style, size)
+        if loaded is None or not loaded[0]:
+            return jsonify({'error': f'No placement box for {style} / {size}'}), 404
+        box, dims = loaded
+        source = f"annotations/{style}/{style}_{size}.json"
+
+    sensor_size = getattr(camera, 'sensor_size', None)
+    if sensor_size is None:
+        return jsonify({'error': 'Camera does not support a readout ROI'}), 409
+    try:
+        x1, y1, x2, y2 = (float(v) for v in box)
+        margin = float(data.get('margin', MEASUREMENT_ROI_MARGIN))
+        sensor_w, sensor_h = sensor_size
+        sx = sensor_w / float(dims['width']) if dims else 1.0
+        sy = sensor_h / float(dims['height']) if dims else 1.0
+    except (TypeError, ValueError, KeyError, ZeroDivisionError) as e:
+        return jsonify({'error': f'Invalid placement box: {e}'}), 400
+    # The annotator stores boxes in drag order, so corners may be swapped
+    x1, x2 = sorted((x1, x2))
+    y1, y2 = sorted((y1, y2))
+    if x2 == x1 or y2 == y1:
+        return jsonify({'error': 'Invalid placement box: empty'}), 400
+
+    pad_x = (x2 - x1) * margin
+    pad_y = (y2 - y1) * margin
+    x = (x1 - pad_x) * sx
+    y = (y1 - pad_y) * sy
+    roi = camera.set_roi((x, y, (x2 + pad_x) * sx - x, (y2 + pad_y) * sy - y))
+    if roi is None:
+        return jsonify({'error': 'Camera rejected the readout ROI'}), 409
+    clear_latest_frame()
+    print(f"[INFO] Measurement ROI {tuple(roi)} from {source}")
+    return jsonify({
+        'success': True,
+        'roi': list(roi),
+        'sensor_size': list(sensor_size),
+        'source': source,
+    })
 
+
+# Thumbnail part of /api/capture-multipart
+THUMBNAIL_WIDTH = 320
+THUMBNAIL_QUALITY = 80
+
+
+def multipart_parts(boundary, parts):
+    """Yield a multipart/form-data body of (name, filename, content_type, data)."""
+    delimiter = f'--{boundary}\r\n'.encode()
+    for name, filename, content_type, data in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename:
+            disposition += f'; filename="{filename}"'
+        yield delimiter + (f'Content-Disposition: {disposition}\r\n'
+                           f'Content-Type: {content_type}\r\n'
+                           f'Content-Length: {len(data)}\r\n\r\n').encode()
+        yield data
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+@app.route('/api/capture-multipart', methods=['GET'])
+def capture_multipart():
+    """Capture returning metadata, full JPEG and thumbnail as multipart/form-data."""
+    if not camera or not camera.is_open:
+        return jsonify({'error': 'Camera not available'}), 503
+
+    timer = CaptureTimer()
+    frame, settle = take_capture(request.args.get('mode', current_mode), timer)
     if frame is None:
-        return jsonify({'error': 'Failed to capture frame'}), 500
+        return timed_response(jsonify({'error': 'Failed to capture frame'}),
+                              timer.finish()), 500
+
+    with frame:
+        jpeg, meta = encode_capture(frame, timer)
+        h, w = frame.image.shape[:2]
+        thumb_w = min(THUMBNAIL_WIDTH, w)
+        thumb_h = max(1, round(h * thumb_w / w))
+        with timer.phase('thumbnail'):
+            thumb = cv2.resize(frame.image, (thumb_w, thumb_h),
+                               interpolation=cv2.INTER_AREA)
+    with timer.phase('thumbnail'), ENCODE_SECONDS.time(kind='thumbnail'):
+        thumb_jpeg = jpeg_encoder.encode(thumb, THUMBNAIL_QUALITY)
+    timer.finish()
+
+    metadata = json.dumps({
+        'success': True,
+        'width': w,
+        'height': h,
+        'thumbnail_width': thumb_w,
+        'thumbnail_height': thumb_h,
+        'mode': current_mode,
+        'timestamp': meta['timestamp'],
+        'frame_seq': frame.seq,
+        'captured_at': to_epoch(frame.captured_at),
+        'exposure_us': frame.exposure_us,
+        'offset_x': frame.offset_x,
+        'offset_y': frame.offset_y,
+        'gain': frame.gain,
+        'camera_type': camera.camera_type,
+        **settle,
+        'timing': timer.as_dict(),
+    }).encode()
+
+    boundary = uuid.uuid4().hex
+    parts = [
+        ('metadata', None, 'application/json', metadata),
+        ('image', f'capture_{frame.seq}.jpg', 'image/jpeg', jpeg),
+        ('thumbnail', f'thumb_{frame.seq}.jpg', 'image/jpeg', thumb_jpeg),
+    ]
+    return Response(multipart_parts(boundary, parts),
+                    mimetype=f'multipart/form-data; boundary={boundary}',
+                    headers={'Cache-Control': 'no-cache',
+                             'Server-Timing': timer.header()})
+
+
+# /api/capture-raw formats: (extension, mimetype, fastest imencode params)
+LOSSLESS_FORMATS = {
+    'png': ('.png', 'image/png', [cv2.IMWRITE_PNG_COMPRESSION, 1]),
+    'tiff': ('.tiff', 'image/tiff', [cv2.IMWRITE_TIFF_COMPRESSION, 32773]),
+}
+
+
+@app.route('/api/capture-raw', methods=['GET'])
+def capture_raw():
+    """Lossless capture: ?format=raw (default) pixels, or png / tiff."""
+    if not camera or not camera.is_open:
+        return jsonify({'error': 'Camera not available'}), 503
 
-    _, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
-    h, w = frame.shape[:2]
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    fmt = request.args.get('format', 'raw').lower()
+    if fmt != 'raw' and fmt not in LOSSLESS_FORMATS:
+        return jsonify({'error': 'Invalid format. Use "raw", "png" or "tiff".'}), 400
 
-    return Response(
-        jpeg.tobytes(),
-        mimetype='image/jpeg',
-        headers={
-            'X-Image-Width': str(w),
-            'X-Image-Height': str(h),
-            'X-Capture-Timestamp': timestamp,
-            'X-Camera-Mode': current_mode,
-            'Cache-Control': 'no-cache',
-        }
-    )
+    timer = CaptureTimer()
+    frame, settle = take_capture(request.args.get('mode', current_mode), timer)
+    if frame is None:
+        return timed_response(jsonify({'error': 'Failed to capture frame'}),
+                              timer.finish()), 500
+
+    image = frame.image
+    headers = capture_headers(frame, settle)
+    headers['X-Image-Stride'] = str(image.strides[0])
+    headers['X-Pixel-Format'] = 'MONO8' if image.ndim == 2 else 'BGR8'
+
+    if fmt in LOSSLESS_FORMATS:
+        ext, mimetype, params = LOSSLESS_FORMATS[fmt]
+        with frame, timer.phase('encode'), ENCODE_SECONDS.time(kind=fmt):
+            ok, data = cv2.imencode(ext, image, params)
+        if not ok:
+            return timed_response(jsonify({'error': f'{fmt.upper()} encode failed'}),
+                                  timer.finish()), 500
+        headers['Server-Timing'] = timer.finish().header()
+        return Response(data.tobytes(), mimetype=mimetype, headers=headers)
+
+    with frame, timer.phase('copy'):
+        data = image.tobytes()    # C order, so rows are packed
+    headers['X-Image-Stride'] = str(len(data) // image.shape[0])
+    headers['Server-Timing'] = timer.finish().header()
+    return Response(data, mimetype='application/octet-stream', headers=headers)
 
 
 @app.route('/api/preview', methods=['GET'])
 def preview():
     """Return latest frame as a single JPEG image."""
-    with frame_lock:
-        frame = latest_frame
+    frame = acquire_latest()
 
     if frame is None:
         # Try a direct grab
@@ -561,8 +2839,40 @@ def preview():
     if frame is None:
         return jsonify({'error': 'No frame available'}), 503
 
-    _, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
-    return Response(jpeg.tobytes(), mimetype='image/jpeg')
+    with frame:
+        jpeg, _ = encode_cached(frame, 90)
+    return Response(jpeg, mimetype='image/jpeg',
+                    headers={'X-Frame-Seq': str(frame.seq)})
+
+
+@app.route('/api/capture/stats', methods=['GET'])
+def capture_stats():
+    """Rolling p50 / p90 / p99 of each capture phase over recent captures."""
+    return jsonify({
+        'window': CAPTURE_STATS_WINDOW,
+        **capture_phase_stats(),
+    })
+
+
+@app.route('/api/capture/<int:seq>', methods=['GET'])
+def capture_refetch(seq):
+    """Re-fetch a recent capture by its frame sequence, from encode_cache."""
+    entry = encode_cache.get((seq, 1.0, CAPTURE_QUALITY, 'jpeg'))
+    if entry is None or 'timestamp' not in entry[1]:
+        return jsonify({'error': f'Capture {seq} is no longer cached'}), 404
+
+    jpeg, meta = entry
+    return Response(
+        jpeg,
+        mimetype='image/jpeg',
+        headers={
+            'X-Image-Width': str(meta['width']),
+            'X-Image-Height': str(meta['height']),
+            'X-Capture-Timestamp': meta['timestamp'],
+            'X-Camera-Mode': meta['mode'],
+            'X-Frame-Seq': str(seq),
+        }
+    )
 
 
 # ============================================================================
@@ -571,7 +2881,10 @@ def preview():
 
 def cleanup():
     """Clean up camera resources."""
+    stop_recording()
     stop_streaming()
+    if shm_publisher:
+        shm_publisher.close()
     if camera:
         camera.close()
     print("[INFO] Camera closed. Server shutting down.")
@@ -582,16 +2895,7 @@ if __name__ == '__main__':
 
     PORT = 5555
 
-    # When auto-started by PHP (no console), stdout/stderr may be invalid
-    # handles. Detect this and redirect to a log file to prevent crashes.
-    _log_path = os.path.join(_project_root, 'storage', 'logs', 'camera_server.log')
-    os.makedirs(os.path.dirname(_log_path), exist_ok=True)
-    try:
-        sys.stdout.flush()
-    except OSError:
-        _lf = open(_log_path, 'a', buffering=1)
-        sys.stdout = _lf
-        sys.stderr = _lf
+    redirect_detached_output()
 
     # Prevent duplicate instances on the same port
     if is_port_in_use(PORT):
@@ -0,0 +1,253 @@
+"""
+Raw Frame Recorder for MagicQC
+==============================
+Records the camera server's MONO8 frames, uncompressed, into a
+preallocated memory-mapped file so a station's problem can be replayed
+later on any machine (see SimulatedCamera in camera_server.py).
+
+Layout (all little-endian):
+
+  Header, 64 bytes
+    magic 'MQRC', version u16, reserved u16, index entry size u32,
+    capacity u64 (index entries), index_offset u64, data_offset u64,
+    count u64 (frames committed; written after each frame's data and
+    index entry, so a crash leaves a readable prefix)
+
+  Index, capacity x INDEX_DTYPE entries (64 bytes each)
+    frame_id u64, offset u64 (file position of the pixels),
+    timestamp f64 (sensor s), captured_at f64 (time.monotonic),
+    exposure_us f64, gain f32, width u32, height u32, binning u8,
+    mode u8 (index into frame_utils.MODES), offset_x u16, offset_y u16
+
+  Data: frames packed back to back, rows contiguous, each frame starting
+  on a 64-byte boundary. Binned preview frames take less room than full
+  resolution ones.
+
+The recorder stops accepting frames once the data area or the index is
+full; on close() the unused preallocated space is cut off the file.
+
+Usage:
+    from frame_recorder import FrameRecording
+    rec = FrameRecording('storage/app/recordings/line3.mqrec')
+    frame = rec[120]                  # O(1), zero-copy view into the file
+    process(frame.image, frame.exposure_us)
+    rec.index['timestamp']            # the whole index as a NumPy array
+
+    python frame_recorder.py recording.mqrec [--list N]
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+from frame_utils import SensorMapped, align, close_mapping, mode_index, mode_name
+
+RECORDING_EXTENSION = '.mqrec'
+
+MAGIC = b'MQRC'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHHIQQQQ')
+HEADER_SIZE = 64
+COUNTER = struct.Struct('<Q')
+COUNT_OFFSET = HEADER.size - COUNTER.size
+
+INDEX_DTYPE = np.dtype([
+    ('frame_id', '<u8'), ('offset', '<u8'), ('timestamp', '<f8'),
+    ('captured_at', '<f8'), ('exposure_us', '<f8'), ('gain', '<f4'),
+    ('width', '<u4'), ('height', '<u4'), ('binning', 'u1'), ('mode', 'u1'),
+    ('offset_x', '<u2'), ('offset_y', '<u2'), ('reserved', 'V6'),
+])
+
+# Defaults: 4 GiB of pixels, about 280 full-resolution 5456x2812 frames
+RECORDER_MAX_BYTES = 4 * 1024 ** 3
+RECORDER_MAX_FRAMES = 100000
+
+
+def _preallocate(f, size):
+    """Reserve *size* bytes on disk, not just a sparse hole where possible."""
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError:
+            pass   # e.g. filesystems without fallocate support
+    f.truncate(size)
+
+
+class FrameRecorder:
+    """Writer side: appends frames to a new recording file."""
+
+    def __init__(self, path, max_bytes=RECORDER_MAX_BYTES,
+                 max_frames=RECORDER_MAX_FRAMES):
+        self.path = path
+        self.capacity = max_frames
+        self.index_offset = HEADER_SIZE
+        self.data_offset = align(HEADER_SIZE + max_frames * INDEX_DTYPE.itemsize, 4096)
+        self.size = self.data_offset + max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'w+b')
+        try:
+            _preallocate(self.file, self.size)
+            self.mm = mmap.mmap(self.file.fileno(), self.size)
+        except (OSError, ValueError):
+            self.file.close()
+            os.remove(path)
+            raise
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, 0, INDEX_DTYPE.itemsize,
+                         max_frames, self.index_offset, self.data_offset, 0)
+        self.index = np.ndarray((max_frames,), dtype=INDEX_DTYPE, buffer=self.mm,
+                                offset=self.index_offset)
+        self.count = 0
+        self.used = 0                 # Bytes of the data area taken
+
+    def record(self, image, frame_id, timestamp, captured_at=0.0,
+               exposure_us=0, gain=0.0, binning=1, mode='other', offset=(0, 0)):
+        """Append a MONO8 *image* and its metadata.
+
+        Returns False (and records nothing) once the file is full.
+        """
+        if image.ndim != 2 or image.dtype != np.uint8:
+            raise ValueError('only MONO8 frames can be recorded')
+        if self.mm is None:
+            raise ValueError('recorder is closed')
+        h, w = image.shape
+        if self.count >= self.capacity or \
+                self.data_offset + self.used + image.nbytes > self.size:
+            return False
+        pos = self.data_offset + self.used
+        dst = np.ndarray((h, w), dtype=np.uint8, buffer=self.mm, offset=pos)
+        np.copyto(dst, image)
+        del dst
+        self.index[self.count] = (
+            frame_id, pos, timestamp, captured_at, exposure_us, gain, w, h,
+            binning, mode_index(mode),
+            offset[0], offset[1], b'')
+        self.used += align(image.nbytes)
+        self.count += 1
+        COUNTER.pack_into(self.mm, COUNT_OFFSET, self.count)
+        return True
+
+    def close(self):
+        """Flush and trim the file to what was actually recorded."""
+        if self.mm is None:
+            return
+        self.index = None
+        self.mm.flush()
+        self.mm.close()
+        self.mm = None
+        self.file.truncate(self.data_offset + self.used)
+        self.file.close()
+
+
+class RecordedFrame(SensorMapped):
+    """One frame of a recording; *image* is a read-only view into the file."""
+
+    __slots__ = ('image', 'frame_id', 'timestamp', 'captured_at',
+                 'exposure_us', 'gain', 'binning', 'mode', 'offset_x',
+                 'offset_y')
+
+    def __init__(self, image, entry):
+        self.image = image
+        self.frame_id = int(entry['frame_id'])
+        self.timestamp = float(entry['timestamp'])
+        self.captured_at = float(entry['captured_at'])
+        self.exposure_us = float(entry['exposure_us'])
+        self.gain = float(entry['gain'])
+        self.binning = int(entry['binning'])
+        self.mode = mode_name(int(entry['mode']))
+        self.offset_x = int(entry['offset_x'])
+        self.offset_y = int(entry['offset_y'])
+
+
+class FrameRecording:
+    """Reader side: random access to the frames of a recording."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError(f"'{path}' is empty")
+        (magic, version, _, itemsize, self.capacity, index_offset,
+         self.data_offset, self.count) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION or itemsize != INDEX_DTYPE.itemsize:
+            self.close()
+            raise ValueError(f"'{path}' is not a MagicQC recording (v{VERSION})")
+        # Whole index as a structured array, e.g. index['exposure_us']
+        self.index = np.frombuffer(self.mm, dtype=INDEX_DTYPE, count=self.count,
+                                   offset=index_offset)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        """Frame *i* (negative counts from the end); the image is zero-copy."""
+        entry = self.index[i]
+        h, w = int(entry['height']), int(entry['width'])
+        image = np.frombuffer(self.mm, dtype=np.uint8, count=w * h,
+                              offset=int(entry['offset'])).reshape((h, w))
+        return RecordedFrame(image, entry)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def find(self, frame_id):
+        """Position of the frame with *frame_id*, or None. Ids increase."""
+        ids = self.index['frame_id']
+        i = int(np.searchsorted(ids, frame_id))
+        if i < self.count and ids[i] == frame_id:
+            return i
+        return None
+
+    @property
+    def max_frame_bytes(self):
+        if not self.count:
+            return 0
+        return int((self.index['width'].astype(np.uint64)
+                    * self.index['height']).max())
+
+    def close(self):
+        self.index = None
+        close_mapping(self.mm)
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='recording file')
+    parser.add_argument('--list', type=int, default=10, metavar='N',
+                        help='print the first N index entries')
+    args = parser.parse_args()
+
+    try:
+        rec = FrameRecording(args.path)
+    except (OSError, ValueError) as e:
+        print(f"[ERR] {e}")
+        return 1
+    index = rec.index
+    print(f"[INFO] {args.path}: {len(rec)} frames")
+    if len(rec) > 1:
+        duration = index['captured_at'][-1] - index['captured_at'][0]
+        print(f"[INFO] {duration:.2f} s, {(len(rec) - 1) / max(duration, 1e-9):.1f} fps, "
+              f"frames {index['frame_id'][0]}..{index['frame_id'][-1]}")
+    for i in range(min(args.list, len(rec))):
+        e = index[i]
+        print(f"  #{i} id={e['frame_id']} {e['width']}x{e['height']} "
+              f"bin={e['binning']} mode={mode_name(int(e['mode'])) or '?'} "
+              f"exp={e['exposure_us']:.0f}us gain={e['gain']:.1f} "
+              f"ts={e['timestamp']:.4f}")
+    rec.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""
+Shared-Memory Frame Ring for MagicQC
+====================================
+The camera server publishes every frame it grabs into a small ring of
+slots in a named multiprocessing.shared_memory block. Local processes
+(annotator, measurement scripts, Electron helpers) attach with
+FrameReader and get frames as NumPy arrays without any JPEG encode,
+HTTP round trip or decode.
+
+The ring carries exactly what the server streams. With PREVIEW_BINNING
+(the default) that is the binned preview, e.g. 1364x703 for a 5456x2812
+sensor, except for the full-resolution frames exposed for captures.
+Check frame.binning: 1 means full resolution, N means each image pixel
+covers NxN sensor pixels (frame.to_sensor() maps coordinates back).
+Measurement code that needs full resolution should wait with
+full_resolution=True and trigger a capture, or run the server with
+PREVIEW_BINNING = False.
+
+Layout (all little-endian):
+
+  Block header, 64 bytes
+    magic 'MQFR', version u16, slot_count u16, slot_size u64,
+    published u64 (frames written so far; latest slot is
+    (published - 1) % slot_count)
+
+  slot_count x slot, each a 64-byte header followed by slot_size bytes
+  of pixel data (rows packed, stride = width * channels)
+    lock u64 (seqlock: odd while the writer is inside the slot),
+    seq u64, timestamp f64 (sensor s), captured_at f64 (time.monotonic),
+    exposure_us f64, gain f32, width u32, height u32, stride u32,
+    channels u8, binning u8, mode u8 (index into frame_utils.MODES),
+    offset_x u16, offset_y u16 (full-sensor position of pixel 0,0 when
+    the camera reads out a ROI)
+
+Reads are lock-free: a reader samples the slot's lock, reads, and checks
+the lock again; a changed or odd value means the writer got in the way
+and the read is retried. Zero-copy frames stay valid until the writer
+laps the ring (slot_count - 1 more frames) — call frame.valid() after
+using one to make sure it was not overwritten meanwhile.
+
+Usage:
+    from frame_shm import FrameReader
+    reader = FrameReader()
+    frame = reader.wait()             # newest frame, zero-copy
+    process(frame.image)              # binned preview unless frame.binning == 1
+    if not frame.valid():
+        ...                           # overwritten while processing; retry
+
+    python frame_shm.py               # print frames as they arrive
+"""
+
+import struct
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from frame_utils import SensorMapped, align, close_mapping, mode_index, mode_name
+
+SHM_NAME = 'magicqc_frames'
+SHM_SLOTS = 3
+
+MAGIC = b'MQFR'
+VERSION = 2
+
+BLOCK_HEADER = struct.Struct('<4sHHQQ')
+BLOCK_HEADER_SIZE = 64
+PUBLISHED_OFFSET = 16
+SLOT_HEADER = struct.Struct('<QQdddfIIIBBBHH')
+SLOT_HEADER_SIZE = 64
+COUNTER = struct.Struct('<Q')
+
+
+def _slot_offset(index, slot_size):
+    return BLOCK_HEADER_SIZE + index * (SLOT_HEADER_SIZE + align(slot_size))
+
+
+def _untrack(shm):
+    """Stop this process's resource tracker from unlinking a block it only reads."""
+    if sys.platform == 'win32':
+        return
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+class FramePublisher:
+    """Writer side, owned by the camera server."""
+
+    def __init__(self, slot_size, name=SHM_NAME, slots=SHM_SLOTS):
+        self.name = name
+        self.slots = slots
+        self.slot_size = slot_size
+        size = _slot_offset(slots, slot_size)
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a server that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self.buf = self.shm.buf
+        self.published = 0
+        BLOCK_HEADER.pack_into(self.buf, 0, MAGIC, VERSION, slots, slot_size, 0)
+
+    def publish(self, image, seq, timestamp, captured_at, exposure_us=0,
+                gain=0.0, binning=1, mode='other', offset=(0, 0)):
+        """Copy *image* (MONO8 or BGR8) into the next slot.
+
+        Returns False if the image does not fit a slot.
+        """
+        if image.nbytes > self.slot_size:
+            return False
+        h, w = image.shape[:2]
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        pos = _slot_offset(self.published % self.slots, self.slot_size)
+
+        (lock,) = COUNTER.unpack_from(self.buf, pos)
+        COUNTER.pack_into(self.buf, pos, lock + 1)
+        dst = np.ndarray(image.shape, dtype=np.uint8, buffer=self.buf,
+                         offset=pos + SLOT_HEADER_SIZE)
+        np.copyto(dst, image)
+        SLOT_HEADER.pack_into(
+            self.buf, pos, lock + 1, seq, timestamp, captured_at,
+            exposure_us, gain, w, h, w * channels, channels, binning,
+            mode_index(mode), *offset)
+        COUNTER.pack_into(self.buf, pos, lock + 2)
+
+        self.published += 1
+        COUNTER.pack_into(self.buf, PUBLISHED_OFFSET, self.published)
+        return True
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ShmFrame(SensorMapped):
+    """A frame read from the ring; *image* may be a view into shared memory."""
+
+    __slots__ = ('image', 'seq', 'timestamp', 'captured_at', 'exposure_us',
+                 'gain', 'binning', 'mode', 'offset_x', 'offset_y',
+                 '_reader', '_offset', '_lock')
+
+    def __init__(self, image, header, reader=None, offset=0):
+        (self._lock, self.seq, self.timestamp, self.captured_at,
+         self.exposure_us, self.gain, _, _, _, _, self.binning,
+         mode, self.offset_x, self.offset_y) = header
+        self.mode = mode_name(mode)
+        self.image = image
+        self._reader = reader
+        self._offset = offset
+
+    def valid(self):
+        """True if the slot behind a zero-copy image has not been rewritten."""
+        if self._reader is None:
+            return True
+        return self._reader._lock_at(self._offset) == self._lock
+
+
+class FrameReader:
+    """Reader side: attach to the camera server's ring and read frames."""
+
+    def __init__(self, name=SHM_NAME, untrack=True):
+        # Raises FileNotFoundError if the camera server is not publishing
+        self.shm = shared_memory.SharedMemory(name)
+        # A publisher spawned by this process shares our resource tracker
+        # and unregisters the block itself; pass untrack=False then.
+        if untrack:
+            _untrack(self.shm)
+        self.buf = self.shm.buf
+        magic, version, self.slots, self.slot_size, _ = \
+            BLOCK_HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"'{name}' is not a MagicQC frame ring (v{VERSION})")
+
+    @property
+    def published(self):
+        return COUNTER.unpack_from(self.buf, PUBLISHED_OFFSET)[0]
+
+    def _lock_at(self, offset):
+        return COUNTER.unpack_from(self.buf, offset)[0]
+
+    def read(self, copy=False, retries=100):
+        """Newest frame as a ShmFrame, or None if nothing was published yet.
+
+        With copy=False the image is a view into shared memory (see
+        ShmFrame.valid); copy=True returns a private, verified copy.
+        """
+        for _ in range(retries):
+            published = self.published
+            if published == 0:
+                return None
+            offset = _slot_offset((published - 1) % self.slots, self.slot_size)
+            header = SLOT_HEADER.unpack_from(self.buf, offset)
+            lock = header[0]
+            if lock & 1:
+                continue
+            w, h, stride, channels = header[6:10]
+            shape = (h, w) if channels == 1 else (h, w, channels)
+            image = np.ndarray(shape, dtype=np.uint8, buffer=self.buf,
+                               offset=offset + SLOT_HEADER_SIZE,
+                               strides=(stride, channels, 1)[:len(shape)])
+            if copy:
+                image = image.copy()
+            # Header and pixels are only consistent if the lock never moved
+            if self._lock_at(offset) != lock:
+                continue
+            if copy:
+                return ShmFrame(image, header)
+            image.flags.writeable = False
+            return ShmFrame(image, header, self, offset)
+        return None
+
+    def wait(self, after_seq=0, timeout=1.0, copy=False, poll=0.002,
+             full_resolution=False):
+        """Block until a frame newer than *after_seq* is published.
+
+        With full_resolution=True binned preview frames are skipped, so
+        only capture frames (or an unbinned stream) are returned.
+        Returns the ShmFrame, or None on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            frame = self.read(copy=copy)
+            if frame is not None and frame.seq > after_seq:
+                if not full_resolution or frame.binning == 1:
+                    return frame
+                after_seq = frame.seq
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll)
+
+    def close(self):
+        self.buf = None
+        close_mapping(self.shm)
+
+
+def main():
+    try:
+        reader = FrameReader()
+    except FileNotFoundError:
+        print(f"[ERR] No frame ring '{SHM_NAME}' — is camera_server.py running?")
+        return 1
+    print(f"[INFO] Attached: {reader.slots} slots of {reader.slot_size // 1024} KB")
+    seq = 0
+    start = time.monotonic()
+    count = 0
+    try:
+        while True:
+            frame = reader.wait(seq, timeout=2.0)
+            if frame is None:
+                print("[WARN] No new frames")
+                continue
+            seq = frame.seq
+            count += 1
+            h, w = frame.image.shape[:2]
+            elapsed = time.monotonic() - start
+            print(f"seq={seq} {w}x{h} bin={frame.binning} mode={frame.mode} "
+                  f"exp={frame.exposure_us:.0f}us gain={frame.gain:.1f} "
+                  f"age={(time.monotonic() - frame.captured_at) * 1000:.1f}ms "
+                  f"{count / elapsed:.1f} fps")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Frame Helpers for MagicQC
+=========================
+Small pieces shared by the camera server, the shared-memory ring, the
+frame recorder and the benchmark scripts, so the frame formats and
+frame types cannot drift apart. Depends on NumPy only.
+"""
+
+import numpy as np
+
+
+def synthetic_frame(width, height, seed=0):
+    """Garment-like MONO8 test frame: lit background, dark shape, texture, noise."""
+    rng = np.random.default_rng(seed)
+    # Open grids: broadcasting builds the frame without full-size x / y arrays
+    y, x = (g.astype(np.float32) for g in np.ogrid[0:height, 0:width])
+    # Uneven table lighting
+    frame = 170 + 40 * np.cos((x - width / 2) / width * np.pi) \
+        * np.cos((y - height / 2) / height * np.pi)
+    # Garment with fabric weave texture
+    garment = ((x - width / 2) / (width * 0.3)) ** 2 + \
+        ((y - height / 2) / (height * 0.35)) ** 2 < 1
+    weave = 8 * np.sin(x * 0.9) * np.sin(y * 0.9)
+    frame = np.where(garment, 60 + weave, frame)
+    frame += rng.normal(0, 3, frame.shape)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+# Garment colour modes, in the order of the u8 code stored in frame headers
+MODES = ('black', 'white', 'other')
+
+
+def mode_index(mode):
+    """u8 code of *mode*; 0xFF if it is not one of MODES."""
+    return MODES.index(mode) if mode in MODES else 0xFF
+
+
+def mode_name(index):
+    """Mode stored as u8 *index*, or None if unknown."""
+    return MODES[index] if index < len(MODES) else None
+
+
+def align(n, to=64):
+    """*n* rounded up to a multiple of *to*."""
+    return -(-n // to) * to
+
+
+def close_mapping(mapping):
+    """Close an mmap / SharedMemory that zero-copy frames may still view."""
+    try:
+        mapping.close()
+    except BufferError:
+        pass   # Zero-copy frames still alive; unmapped when they go
+
+
+class SensorMapped:
+    """Mixin for frames with offset_x, offset_y and binning attributes."""
+
+    __slots__ = ()
+
+    def to_sensor(self, x, y):
+        """Map image pixel (x, y) to full-sensor pixel coordinates."""
+        return (self.offset_x + x * self.binning,
+                self.offset_y + y * self.binning)
@@ -0,0 +1,244 @@
+"""
+JPEG Encoder Backends for the MagicQC Camera Server
+===================================================
+Every JPEG the camera server produces (stream, preview, capture) goes
+through one of these encoders.
+
+  OpenCVEncoder        - cv2.imencode, always available
+  TurboJpegEncoder     - libjpeg-turbo via PyTurboJPEG, with the fast DCT
+                         and a native single-channel path for MONO8 frames
+  ParallelJpegEncoder  - wraps either backend: encodes horizontal strips on
+                         a thread pool and stitches one valid JPEG using
+                         restart markers
+
+get_encoder('auto') prefers TurboJPEG and falls back to OpenCV when the
+package or the shared library is missing.
+
+Install the fast path with:
+    pip install PyTurboJPEG
+(plus libjpeg-turbo itself on Linux, e.g. apt install libturbojpeg)
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+TURBOJPEG_AVAILABLE = False
+try:
+    from turbojpeg import (
+        TurboJPEG, TJPF_GRAY, TJPF_BGR, TJSAMP_GRAY, TJSAMP_420,
+        TJSAMP_422, TJSAMP_444, TJSAMP_440, TJSAMP_411, TJFLAG_FASTDCT,
+    )
+    TURBOJPEG_AVAILABLE = True
+except ImportError:
+    pass
+
+
+class OpenCVEncoder:
+    """JPEG encoding through cv2.imencode."""
+
+    name = 'opencv'
+
+    def encode(self, image, quality):
+        """Encode a MONO8 or BGR image. Returns JPEG bytes."""
+        ok, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise RuntimeError('cv2.imencode failed')
+        return jpeg.tobytes()
+
+    def mcu_size(self, image):
+        """(width, height) of one MCU; OpenCV writes color as 4:2:0."""
+        return (8, 8) if image.ndim == 2 else (16, 16)
+
+
+class TurboJpegEncoder:
+    """JPEG encoding through libjpeg-turbo.
+
+    MONO8 frames are written as single-component (grayscale) JPEGs, so no
+    chroma planes are built. Color frames use *subsample* chroma
+    subsampling, or are reduced to grayscale first when *grayscale* is set.
+    """
+
+    name = 'turbojpeg'
+
+    def __init__(self, fast_dct=True, subsample=None, grayscale=False,
+                 lib_path=None):
+        # Raises RuntimeError / OSError if libturbojpeg cannot be loaded
+        self.jpeg = TurboJPEG(lib_path)
+        self.flags = TJFLAG_FASTDCT if fast_dct else 0
+        self.subsample = TJSAMP_420 if subsample is None else subsample
+        self.grayscale = grayscale
+
+    def encode(self, image, quality):
+        """Encode a MONO8 or BGR image. Returns JPEG bytes."""
+        if image.ndim == 3 and self.grayscale:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        image = np.ascontiguousarray(image)
+        if image.ndim == 2:
+            return self.jpeg.encode(image, quality=quality,
+                                    pixel_format=TJPF_GRAY,
+                                    jpeg_subsample=TJSAMP_GRAY,
+                                    flags=self.flags)
+        return self.jpeg.encode(image, quality=quality,
+                                pixel_format=TJPF_BGR,
+                                jpeg_subsample=self.subsample,
+                                flags=self.flags)
+
+    def mcu_size(self, image):
+        """(width, height) of one MCU for *image* with this subsampling."""
+        if image.ndim == 2 or self.grayscale:
+            return (8, 8)
+        return {
+            TJSAMP_444: (8, 8),
+            TJSAMP_422: (16, 8),
+            TJSAMP_420: (16, 16),
+            TJSAMP_440: (8, 16),
+            TJSAMP_411: (32, 8),
+        }.get(self.subsample, (16, 16))
+
+
+# Largest restart interval a DRI segment can express, in MCUs
+MAX_RESTART_INTERVAL = 0xFFFF
+
+
+def _scan_layout(jpeg):
+    """Locate the frame header and the scan in a baseline JPEG.
+
+    Returns (sof_offset, sos_offset, scan_offset): where the SOF segment
+    starts, where the SOS segment starts and where entropy-coded data
+    begins.
+    """
+    if jpeg[:2] != b'\xff\xd8':
+        raise ValueError('not a JPEG')
+    pos = 2
+    sof = None
+    while pos + 4 <= len(jpeg):
+        if jpeg[pos] != 0xFF:
+            raise ValueError(f'bad marker at offset {pos}')
+        marker = jpeg[pos + 1]
+        if marker == 0xFF:          # fill byte
+            pos += 1
+            continue
+        length = int.from_bytes(jpeg[pos + 2:pos + 4], 'big')
+        if marker in (0xC0, 0xC1):
+            sof = pos
+        elif 0xC2 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            raise ValueError('only baseline sequential JPEGs can be stitched')
+        elif marker == 0xDD:
+            raise ValueError('strip already uses restart markers')
+        elif marker == 0xDA:
+            if sof is None:
+                raise ValueError('SOS before SOF')
+            return sof, pos, pos + 2 + length
+        pos += 2 + length
+    raise ValueError('no SOS segment')
+
+
+def _scan_data(jpeg):
+    """Entropy-coded data of a single-scan JPEG, without SOS header or EOI."""
+    _, _, scan = _scan_layout(jpeg)
+    end = jpeg.rfind(b'\xff\xd9')
+    if end < scan:
+        raise ValueError('missing EOI')
+    return jpeg[scan:end]
+
+
+class ParallelJpegEncoder:
+    """Encodes large frames as horizontal strips on a thread pool.
+
+    Each strip is a whole number of MCU rows and is encoded on its own by
+    the *base* encoder (OpenCV and libjpeg-turbo both release the GIL).
+    Identical settings give identical quantization tables, and neither
+    backend optimizes Huffman tables by default, so the tables match and
+    so the strips' scans can be joined into one JPEG. The joined file
+    takes its headers from the first strip, patches the frame height,
+    and sets a DRI restart interval of one strip. The strips are joined
+    with RST0..RST7 markers. Restarts reset the DC predictors, just as
+    the start of each strip's own encode did, so the result decodes to
+    exactly what a single-threaded encode of the same frame would.
+    """
+
+    def __init__(self, base, workers=None, min_strip_rows=256):
+        self.base = base
+        self.name = f'{base.name}-parallel'
+        self.workers = workers or os.cpu_count() or 1
+        self.min_strip_rows = min_strip_rows
+        self.pool = ThreadPoolExecutor(max_workers=self.workers,
+                                       thread_name_prefix='jpeg-strip')
+
+    def mcu_size(self, image):
+        return self.base.mcu_size(image)
+
+    def _strip_rows(self, image):
+        h, w = image.shape[:2]
+        mcu_w, mcu_h = self.base.mcu_size(image)
+        mcus_per_row = -(-w // mcu_w)
+        rows = max(-(-h // self.workers), self.min_strip_rows)
+        rows = -(-rows // mcu_h) * mcu_h
+        # A strip is one restart interval, which DRI caps at 65535 MCUs
+        max_rows = (MAX_RESTART_INTERVAL // mcus_per_row) * mcu_h
+        rows = min(rows, max_rows)
+        return rows, (rows // mcu_h) * mcus_per_row
+
+    def encode(self, image, quality):
+        """Encode a MONO8 or BGR image. Returns JPEG bytes."""
+        h = image.shape[0]
+        rows, interval = self._strip_rows(image)
+        if rows <= 0 or rows >= h or self.workers == 1:
+            return self.base.encode(image, quality)
+
+        starts = range(0, h, rows)
+        strips = list(self.pool.map(
+            lambda y: self.base.encode(image[y:y + rows], quality), starts))
+        try:
+            return self._stitch(strips, h, interval)
+        except ValueError as e:
+            print(f"[WARN] JPEG strip stitching failed ({e}); encoding whole frame")
+            return self.base.encode(image, quality)
+
+    @staticmethod
+    def _stitch(strips, height, interval):
+        first = strips[0]
+        sof, sos, scan = _scan_layout(first)
+        # Only strip 0's tables are kept, so every strip must share them
+        # (per-image optimized Huffman tables would corrupt the result)
+        tables = first[:sof + 5] + first[sof + 7:scan]
+        for strip in strips[1:]:
+            s_sof, _, s_scan = _scan_layout(strip)
+            if strip[:s_sof + 5] + strip[s_sof + 7:s_scan] != tables:
+                raise ValueError('strips use different JPEG tables')
+        header = bytearray(first[:sos])
+        header[sof + 5:sof + 7] = height.to_bytes(2, 'big')
+        header += b'\xff\xdd\x00\x04' + interval.to_bytes(2, 'big')
+        header += first[sos:scan]
+
+        parts = [bytes(header)]
+        last = len(strips) - 1
+        for i, strip in enumerate(strips):
+            parts.append(_scan_data(strip))
+            if i < last:
+                parts.append(bytes((0xFF, 0xD0 + (i % 8))))
+        parts.append(b'\xff\xd9')
+        return b''.join(parts)
+
+
+def get_encoder(backend='auto', **options):
+    """Create a JPEG encoder.
+
+    *backend* is 'auto', 'turbojpeg' or 'opencv'. 'auto' and 'turbojpeg'
+    fall back to OpenCV if libjpeg-turbo cannot be loaded. *options* are
+    passed to TurboJpegEncoder.
+    """
+    if backend in ('auto', 'turbojpeg'):
+        if TURBOJPEG_AVAILABLE:
+            try:
+                return TurboJpegEncoder(**options)
+            except (RuntimeError, OSError) as e:
+                print(f"[WARN] libjpeg-turbo not loadable ({e}); using OpenCV encoder")
+        elif backend == 'turbojpeg':
+            print("[WARN] PyTurboJPEG not installed; using OpenCV encoder")
+    elif backend != 'opencv':
+        print(f"[WARN] Unknown JPEG encoder '{backend}'; using OpenCV encoder")
+    return OpenCVEncoder()